@@ -0,0 +1,333 @@
+import typing
+
+import numpy as np
+
+from compute_actions import (
+    build_action_for_get_dot,
+    build_action_for_take_puzzle,
+    build_action_for_upgrade_piece,
+    build_action_for_place_piece,
+    build_action_for_master,
+    build_action_for_stop,
+    iter_all_master,
+)
+from piece import (
+    Piece,
+    Placement,
+    PIECE_TYPES,
+    piece_index,
+    piece_size,
+    placements,
+    placement_of,
+)
+from projectl import (
+    ProjectLGame,
+    ActionData,
+    ActionEnum,
+    CompactAction,
+    TakeData,
+    UpgradePieceData,
+    PlacePieceData,
+    MasterData,
+    compact_action,
+)
+
+# Every action gets an integer id. The dense part of the space is
+#
+#   TAKE_PUZZLE     0 .. 7 (which_puzzle)
+#   GET_DOT         8
+#   UPGRADE_PIECE   one id per (from, to) pair allowed by the upgrade rules
+#   PLACE_PIECE     one id per (puzzle, placement) with puzzle in 0 .. 3
+#   STOP            STOP_ID
+#   MASTER slots    MASTER_SLOT_OFFSET .. ACTION_SPACE_SIZE - 1
+#
+# and a MASTER action is ACTION_SPACE_SIZE plus its placements written as a
+# number in base len(placements) + 1, one digit per puzzle (the digit is the
+# placement index plus one), so it lives outside of the fixed size space.
+#
+# The MASTER slots are how a policy over the fixed size space plays MASTER:
+# slot k is the k-th action of master_slot_actions(game), the first
+# MASTER_SLOTS MASTER actions with distinct results in the order of
+# iter_all_master (the same order legal_actions uses). Their meaning depends
+# on the position, so they are decoded with game_action instead of
+# decode_compact_action, and the MASTER actions past the first MASTER_SLOTS
+# cannot be played from the fixed size space.
+
+MAX_PUZZLES = 4
+
+upgrade_pairs: typing.List[typing.Tuple[Piece, Piece]] = [
+    (from_piece, to_piece)
+    for from_piece in list(Piece)
+    for to_piece in list(Piece)
+    if from_piece != to_piece
+    and piece_size[to_piece] in [piece_size[from_piece], piece_size[from_piece] + 1]
+]
+
+TAKE_PUZZLE_OFFSET = 0
+GET_DOT_ID = TAKE_PUZZLE_OFFSET + 8
+UPGRADE_PIECE_OFFSET = GET_DOT_ID + 1
+PLACE_PIECE_OFFSET = UPGRADE_PIECE_OFFSET + len(upgrade_pairs)
+STOP_ID = PLACE_PIECE_OFFSET + MAX_PUZZLES * len(placements)
+MASTER_SLOT_OFFSET = STOP_ID + 1
+MASTER_SLOTS = 32
+ACTION_SPACE_SIZE = MASTER_SLOT_OFFSET + MASTER_SLOTS
+MASTER_OFFSET = ACTION_SPACE_SIZE
+MASTER_BASE = len(placements) + 1
+
+upgrade_ids = {pair: i for i, pair in enumerate(upgrade_pairs)}
+
+
+def place_piece_id(puzzle: int, placement: Placement) -> int:
+    return PLACE_PIECE_OFFSET + puzzle * len(placements) + placement.placement_id
+
+
+def placement_of_data(place_data: PlacePieceData) -> Placement:
+    placement = placement_of.get(
+        (
+            place_data.piece,
+            place_data.rotation,
+            place_data.reversed,
+            place_data.x_coord,
+            place_data.y_coord,
+        )
+    )
+    if placement is None:
+        raise ValueError(f"{place_data} does not fit in a puzzle")
+    return placement
+
+
+def place_data_of_placement(puzzle: int, placement: Placement) -> PlacePieceData:
+    return PlacePieceData(
+        puzzle,
+        placement.piece,
+        placement.x_coord,
+        placement.y_coord,
+        placement.rotation,
+        placement.reversed,
+    )
+
+
+def encode_master(place_piece_actions: typing.Sequence[PlacePieceData]) -> int:
+    digits = {
+        ac.puzzle: placement_of_data(ac).placement_id + 1 for ac in place_piece_actions
+    }
+    if len(digits) == 0 or sorted(digits) != list(range(len(place_piece_actions))):
+        raise ValueError("MASTER needs exactly one placement per puzzle")
+    if len(digits) > MAX_PUZZLES:
+        raise ValueError(f"MASTER with more than {MAX_PUZZLES} puzzles")
+    return MASTER_OFFSET + sum(
+        digit * MASTER_BASE**puzzle for puzzle, digit in digits.items()
+    )
+
+
+def decode_master(action_id: int) -> MasterData:
+    code = action_id - MASTER_OFFSET
+    place_piece_actions: typing.List[PlacePieceData] = []
+    while code > 0:
+        code, digit = divmod(code, MASTER_BASE)
+        if digit == 0 or len(place_piece_actions) == MAX_PUZZLES:
+            raise ValueError(f"{action_id} is not a valid MASTER action id")
+        place_piece_actions.append(
+            place_data_of_placement(len(place_piece_actions), placements[digit - 1])
+        )
+    if len(place_piece_actions) == 0:
+        raise ValueError(f"{action_id} is not a valid MASTER action id")
+    return MasterData(place_piece_actions)
+
+
+def encode_action(action: typing.Union[ActionData, CompactAction]) -> int:
+    if not isinstance(action, CompactAction):
+        action = compact_action(action)
+    action_data = action.action_data
+
+    if action.action == ActionEnum.TAKE_PUZZLE:
+        which_puzzle = typing.cast(TakeData, action_data).which_puzzle
+        if which_puzzle < 0 or which_puzzle > 7:
+            raise ValueError(f"{which_puzzle} must be between 0 and 7")
+        return TAKE_PUZZLE_OFFSET + which_puzzle
+
+    elif action.action == ActionEnum.GET_DOT:
+        return GET_DOT_ID
+
+    elif action.action == ActionEnum.UPGRADE_PIECE:
+        upgrade_data = typing.cast(UpgradePieceData, action_data)
+        pair = (upgrade_data.from_piece, upgrade_data.to_piece)
+        if pair not in upgrade_ids:
+            raise ValueError(f"Bad piece upgrade {pair}")
+        return UPGRADE_PIECE_OFFSET + upgrade_ids[pair]
+
+    elif action.action == ActionEnum.PLACE_PIECE:
+        place_data = typing.cast(PlacePieceData, action_data)
+        if place_data.puzzle < 0 or place_data.puzzle >= MAX_PUZZLES:
+            raise ValueError(f"{place_data.puzzle} must be between 0 and 3")
+        return place_piece_id(place_data.puzzle, placement_of_data(place_data))
+
+    elif action.action == ActionEnum.MASTER:
+        return encode_master(typing.cast(MasterData, action_data).place_piece_actions)
+
+    return STOP_ID
+
+
+def build_compact_actions() -> typing.List[CompactAction]:
+    return [
+        *[
+            CompactAction(ActionEnum.TAKE_PUZZLE, TakeData(which_puzzle))
+            for which_puzzle in range(8)
+        ],
+        CompactAction(ActionEnum.GET_DOT),
+        *[
+            CompactAction(ActionEnum.UPGRADE_PIECE, UpgradePieceData(*pair))
+            for pair in upgrade_pairs
+        ],
+        *[
+            CompactAction(
+                ActionEnum.PLACE_PIECE, place_data_of_placement(puzzle, placement)
+            )
+            for puzzle in range(MAX_PUZZLES)
+            for placement in placements
+        ],
+        CompactAction(ActionEnum.STOP),
+    ]
+
+
+compact_actions = build_compact_actions()
+
+
+def decode_compact_action(action_id: int) -> CompactAction:
+    if action_id < 0:
+        raise ValueError(f"{action_id} is not a valid action id")
+    if action_id >= MASTER_OFFSET:
+        return CompactAction(ActionEnum.MASTER, decode_master(action_id))
+    if action_id >= MASTER_SLOT_OFFSET:
+        raise ValueError(f"{action_id} is a MASTER slot, decode it with game_action")
+    return compact_actions[action_id]
+
+
+def master_slot_actions(game: ProjectLGame) -> typing.List[CompactAction]:
+    if game.remaining_rounds in [0, -1]:
+        return []
+    return [
+        compact_action(action)
+        for action in iter_all_master(game, deduplicate=True, limit=MASTER_SLOTS)
+    ]
+
+
+def game_action(game: ProjectLGame, action_id: int) -> CompactAction:
+    # decode_compact_action that also knows the MASTER slots of the game
+    if MASTER_SLOT_OFFSET <= action_id < ACTION_SPACE_SIZE:
+        slot_actions = master_slot_actions(game)
+        if action_id - MASTER_SLOT_OFFSET >= len(slot_actions):
+            raise ValueError(f"{action_id} is an empty MASTER slot")
+        return slot_actions[action_id - MASTER_SLOT_OFFSET]
+    return decode_compact_action(action_id)
+
+
+def policy_action_id(game: ProjectLGame, action_id: int) -> int:
+    # the id in the fixed size space of an action id of legal_actions
+    if action_id < MASTER_OFFSET:
+        return action_id
+    slot_ids = [encode_action(action) for action in master_slot_actions(game)]
+    if action_id not in slot_ids:
+        raise ValueError(f"{action_id} is not in the first {MASTER_SLOTS} MASTER slots")
+    return MASTER_SLOT_OFFSET + slot_ids.index(action_id)
+
+
+def action_data_of_place_data(
+    place_data: PlacePieceData,
+) -> typing.Dict[str, typing.Any]:
+    return build_action_for_place_piece(*place_data)["action_data"]
+
+
+def decode_action(action_id: int) -> ActionData:
+    action = decode_compact_action(action_id)
+    action_data = action.action_data
+
+    if action.action == ActionEnum.TAKE_PUZZLE:
+        return build_action_for_take_puzzle(
+            typing.cast(TakeData, action_data).which_puzzle
+        )
+
+    elif action.action == ActionEnum.GET_DOT:
+        return build_action_for_get_dot()
+
+    elif action.action == ActionEnum.UPGRADE_PIECE:
+        return build_action_for_upgrade_piece(
+            *typing.cast(UpgradePieceData, action_data)
+        )
+
+    elif action.action == ActionEnum.PLACE_PIECE:
+        return build_action_for_place_piece(*typing.cast(PlacePieceData, action_data))
+
+    elif action.action == ActionEnum.MASTER:
+        return build_action_for_master(
+            [
+                action_data_of_place_data(ac)
+                for ac in typing.cast(MasterData, action_data).place_piece_actions
+            ]
+        )
+
+    return build_action_for_stop()
+
+
+placement_masks = np.array([p.mask for p in placements], dtype=np.int64)
+placement_pieces = np.array([piece_index[p.piece] for p in placements])
+upgrade_from_pieces = np.array(
+    [piece_index[from_piece] for from_piece, _ in upgrade_pairs]
+)
+
+
+def legal_action_mask(
+    game: ProjectLGame,
+    out: typing.Optional[np.ndarray] = None,
+    master_slots: bool = False,
+) -> np.ndarray:
+    # same rules as get_puzzle, upgrade_piece and place_piece, with
+    # master_slots also the used MASTER slots (listing them is much slower
+    # than the rest of the mask)
+    mask = np.zeros(ACTION_SPACE_SIZE, dtype=bool) if out is None else out
+    mask[:] = False
+
+    if game.remaining_rounds == -1:
+        return mask
+
+    player = game.current_player
+    start = player * PIECE_TYPES
+    has_piece = np.array(game.inventories[start : start + PIECE_TYPES]) > 0
+    puzzles = game.players_puzzles[player]
+
+    for i, puzzle in enumerate(puzzles):
+        start = PLACE_PIECE_OFFSET + i * len(placements)
+        mask[start : start + len(placements)] = (
+            placement_masks & puzzle.free == placement_masks
+        ) & has_piece[placement_pieces]
+
+    if game.remaining_rounds == 0:
+        # nothing else changes the game in the last round
+        mask[STOP_ID] = True
+        return mask
+
+    if len(puzzles) < MAX_PUZZLES:
+        for i, table_puzzle in enumerate([*game.black_puzzles, *game.white_puzzles]):
+            mask[TAKE_PUZZLE_OFFSET + i] = table_puzzle is not None
+
+    mask[GET_DOT_ID] = True
+    mask[UPGRADE_PIECE_OFFSET:PLACE_PIECE_OFFSET] = has_piece[upgrade_from_pieces]
+    if master_slots:
+        slots = len(master_slot_actions(game))
+        mask[MASTER_SLOT_OFFSET : MASTER_SLOT_OFFSET + slots] = True
+
+    return mask
+
+
+def legal_actions(
+    game: ProjectLGame, master_limit: typing.Optional[int] = 0
+) -> typing.List[int]:
+    # the ids of legal_action_mask plus up to master_limit MASTER actions
+    # (None for all of them), one for each distinct result
+    action_ids = np.flatnonzero(legal_action_mask(game)).tolist()
+    if game.remaining_rounds not in [0, -1] and master_limit != 0:
+        action_ids.extend(
+            encode_action(action)
+            for action in iter_all_master(game, deduplicate=True, limit=master_limit)
+        )
+    return action_ids
@@ -0,0 +1,476 @@
+import time
+import typing
+from array import array
+
+import numpy as np
+
+from action_space import (
+    ACTION_SPACE_SIZE,
+    GET_DOT_ID,
+    MASTER_SLOT_OFFSET,
+    MAX_PUZZLES,
+    PLACE_PIECE_OFFSET,
+    STOP_ID,
+    UPGRADE_PIECE_OFFSET,
+    master_slot_actions,
+    placement_masks,
+    placement_of_data,
+    placement_pieces,
+    upgrade_from_pieces,
+    upgrade_pairs,
+)
+from piece import BOARD_CELLS, PIECE_TYPES, Piece, piece_index, piece_size, placements
+from observation import (
+    PHASES,
+    PUZZLE_INFO,
+    TABLE_SLOTS,
+    observation_layout,
+)
+from projectl import CompactAction, MasterData, ProjectLGame
+from puzzle import Puzzle, black_puzzles, white_puzzles
+
+# N games of the same size kept in arrays, stepped together with one action
+# id per game (the fixed size ids of action_space). The MASTER slots are only
+# used with master_slots=True: the MASTER actions of the games that may have
+# one are then listed every step through to_game, which is much slower than
+# the rest of the step.
+#
+# Puzzles are referred by a global id, black_puzzles first and then
+# white_puzzles. The table has the 4 black slots followed by the 4 white
+# ones with NO_PUZZLE in the empty slots, and the puzzle slots of the players
+# past their puzzle count are kept zeroed.
+
+NO_PUZZLE = -1
+NO_ROUNDS = 3  # remaining_rounds is None
+BLACK_DECK = len(black_puzzles) - 4
+WHITE_DECK = len(white_puzzles) - 4
+
+all_puzzles = [*black_puzzles, *white_puzzles]
+puzzle_free = np.array([p.free for p in all_puzzles], dtype=np.int32)
+puzzle_cells = np.array([p.values() for p in all_puzzles], dtype=np.uint8)
+puzzle_points = np.array([p.points for p in all_puzzles], dtype=np.int32)
+puzzle_rewards = np.array([piece_index[p.reward] for p in all_puzzles], dtype=np.int32)
+
+piece_values = np.array([piece.value for piece in list(Piece)], dtype=np.uint8)
+piece_sizes = np.array([piece_size[piece] for piece in list(Piece)], dtype=np.int32)
+placement_masks32 = placement_masks.astype(np.int32)
+placement_cells = (placement_masks32[:, None] >> np.arange(BOARD_CELLS) & 1).astype(
+    bool
+)
+placement_values = piece_values[placement_pieces]
+upgrade_to_pieces = np.array([piece_index[to_piece] for _, to_piece in upgrade_pairs])
+cell_bits = np.arange(BOARD_CELLS, dtype=np.int32)
+
+
+class BatchProjectLEnv:
+    def __init__(
+        self,
+        num_envs: int,
+        player_quantity: int = 2,
+        seed: typing.Optional[int] = None,
+        master_slots: bool = False,
+    ) -> None:
+        n, players = num_envs, player_quantity
+        self.num_envs = num_envs
+        self.player_quantity = player_quantity
+        self.master_slots = master_slots
+        self.rng = np.random.default_rng(seed)
+        self.envs = np.arange(n)
+
+        self.table = np.full((n, TABLE_SLOTS), NO_PUZZLE, dtype=np.int32)
+        self.black_deck = np.zeros((n, BLACK_DECK), dtype=np.int32)
+        self.white_deck = np.zeros((n, WHITE_DECK), dtype=np.int32)
+        self.black_deck_size = np.zeros(n, dtype=np.int32)
+        self.white_deck_size = np.zeros(n, dtype=np.int32)
+
+        self.inventories = np.zeros((n, players, PIECE_TYPES), dtype=np.int32)
+        self.points = np.zeros((n, players), dtype=np.int32)
+        self.puzzle_count = np.zeros((n, players), dtype=np.int32)
+        self.puzzle_free = np.zeros((n, players, MAX_PUZZLES), dtype=np.int32)
+        self.puzzle_cells = np.zeros(
+            (n, players, MAX_PUZZLES, BOARD_CELLS), dtype=np.uint8
+        )
+        self.puzzle_points = np.zeros((n, players, MAX_PUZZLES), dtype=np.int32)
+        self.puzzle_rewards = np.zeros((n, players, MAX_PUZZLES), dtype=np.int32)
+
+        self.current_player = np.zeros(n, dtype=np.int32)
+        self.remaining_actions = np.zeros(n, dtype=np.int32)
+        self.remaining_rounds = np.zeros(n, dtype=np.int32)
+        self.points_to_pay = np.zeros(n, dtype=np.int32)
+        self.did_master_action = np.zeros(n, dtype=bool)
+        # the actions of the MASTER slots of the legal masks
+        self.master_actions: typing.List[typing.List[CompactAction]] = [
+            [] for _ in range(n)
+        ]
+
+        # points of the games that ended in the last step, before the reset
+        self.final_points = np.zeros((n, players), dtype=np.int32)
+        self.observations = np.zeros(
+            (n, observation_layout(players).size), dtype=np.float32
+        )
+        self.legal_masks = np.zeros((n, ACTION_SPACE_SIZE), dtype=bool)
+        self.place_masks = (
+            self.legal_masks[:, PLACE_PIECE_OFFSET:STOP_ID]
+            .view(np.uint8)
+            .reshape(n, MAX_PUZZLES, len(placements))
+        )
+
+        self.reset_envs(self.envs)
+
+    def reset(self) -> typing.Tuple[np.ndarray, np.ndarray]:
+        self.reset_envs(self.envs)
+        return self.observations, self.legal_masks
+
+    def step(
+        self, actions: np.ndarray
+    ) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # rewards are the points the player that acted won (or paid) with the
+        # action, ended games are reset and their points kept in final_points
+        actions = np.asarray(actions)
+        envs = self.envs
+        player = self.current_player.copy()
+        if not self.legal_masks[envs, actions].all():
+            raise ProjectLGame.InvalidAction(
+                f"Illegal actions in envs {np.flatnonzero(~self.legal_masks[envs, actions])}"
+            )
+        points_before = self.points[envs, player]
+        last_round = self.remaining_rounds == 0
+
+        place = np.flatnonzero((actions >= PLACE_PIECE_OFFSET) & (actions < STOP_ID))
+        if len(place) > 0:
+            slot, placement = np.divmod(
+                actions[place] - PLACE_PIECE_OFFSET, len(placements)
+            )
+            place_player = player[place]
+            self.puzzle_free[place, place_player, slot] &= ~placement_masks32[placement]
+            self.puzzle_cells[place, place_player, slot] = np.where(
+                placement_cells[placement],
+                placement_values[placement][:, None],
+                self.puzzle_cells[place, place_player, slot],
+            )
+            self.inventories[place, place_player, placement_pieces[placement]] -= 1
+            self.points_to_pay[place] += last_round[place]
+
+        for env in np.flatnonzero(actions >= MASTER_SLOT_OFFSET).tolist():
+            self.master_play(env, int(actions[env]) - MASTER_SLOT_OFFSET)
+
+        stop = np.flatnonzero(actions == STOP_ID)
+        self.points[stop, player[stop]] -= self.points_to_pay[stop]
+        self.points_to_pay[stop] = 0
+        self.remaining_actions[stop] = 0
+
+        dot = np.flatnonzero(actions == GET_DOT_ID)
+        self.inventories[dot, player[dot], piece_index[Piece.DOT]] += 1
+
+        upgrade = np.flatnonzero(
+            (actions >= UPGRADE_PIECE_OFFSET) & (actions < PLACE_PIECE_OFFSET)
+        )
+        pair = actions[upgrade] - UPGRADE_PIECE_OFFSET
+        self.inventories[upgrade, player[upgrade], upgrade_from_pieces[pair]] -= 1
+        self.inventories[upgrade, player[upgrade], upgrade_to_pieces[pair]] += 1
+
+        take = np.flatnonzero(actions < GET_DOT_ID)
+        if len(take) > 0:
+            which_puzzle = actions[take]
+            puzzle = self.table[take, which_puzzle]
+            take_player = player[take]
+            slot = self.puzzle_count[take, take_player]
+            self.puzzle_free[take, take_player, slot] = puzzle_free[puzzle]
+            self.puzzle_cells[take, take_player, slot] = puzzle_cells[puzzle]
+            self.puzzle_points[take, take_player, slot] = puzzle_points[puzzle]
+            self.puzzle_rewards[take, take_player, slot] = puzzle_rewards[puzzle]
+            self.puzzle_count[take, take_player] += 1
+            self.table[take, which_puzzle] = NO_PUZZLE
+
+        self.remaining_actions[~last_round] -= 1
+        self.end_action()
+
+        rewards = (self.points[envs, player] - points_before).astype(np.float32)
+        dones = self.remaining_rounds == -1
+        ended = np.flatnonzero(dones)
+        self.final_points[ended] = self.points[ended]
+        if len(ended) > 0:
+            self.reset_envs(ended)
+        else:
+            self.update()
+        return self.observations, rewards, dones, self.legal_masks
+
+    def master_play(self, env: int, slot: int) -> None:
+        action_data = typing.cast(
+            MasterData, self.master_actions[env][slot].action_data
+        )
+        player = self.current_player[env]
+        for place_data in action_data.place_piece_actions:
+            placement = placement_of_data(place_data).placement_id
+            puzzle = place_data.puzzle
+            self.puzzle_free[env, player, puzzle] &= ~placement_masks32[placement]
+            self.puzzle_cells[env, player, puzzle][
+                placement_cells[placement]
+            ] = placement_values[placement]
+            self.inventories[env, player, placement_pieces[placement]] -= 1
+        self.did_master_action[env] = True
+
+    def end_action(self) -> None:
+        envs = self.envs
+        player = self.current_player
+        count = self.puzzle_count[envs, player]
+        present = np.arange(MAX_PUZZLES) < count[:, None]
+        done = present & (self.puzzle_free[envs, player] == 0)
+        if done.any():
+            self.remove_done_puzzles(done)
+
+        next_turn = self.remaining_actions == 0
+        self.remaining_actions[next_turn] = 3
+        self.did_master_action[next_turn] = False
+        self.current_player[next_turn] += 1
+        self.fill_table_with_puzzles(next_turn)
+        self.current_player[self.current_player == self.player_quantity] = 0
+
+        deck_empty = self.black_deck_size == 0
+        start_rounds = deck_empty & (self.remaining_rounds == NO_ROUNDS)
+        next_round = (
+            deck_empty
+            & (self.remaining_rounds != NO_ROUNDS)
+            & (self.current_player == 0)
+        )
+        self.remaining_rounds[start_rounds] = 2
+        self.remaining_rounds[next_round] -= 1
+
+    def remove_done_puzzles(self, done: np.ndarray) -> None:
+        done_envs, done_slots = np.nonzero(done)
+        done_players = self.current_player[done_envs]
+        np.add.at(
+            self.points,
+            (done_envs, done_players),
+            self.puzzle_points[done_envs, done_players, done_slots],
+        )
+        np.add.at(
+            self.inventories,
+            (
+                done_envs,
+                done_players,
+                self.puzzle_rewards[done_envs, done_players, done_slots],
+            ),
+            1,
+        )
+        cells = self.puzzle_cells[done_envs, done_players, done_slots]
+        returned = (cells[:, :, None] == piece_values).sum(axis=1) // piece_sizes
+        np.add.at(
+            self.inventories, (done_envs, done_players), returned.astype(np.int32)
+        )
+
+        # keep the order of the remaining puzzles and zero the freed slots
+        envs = np.unique(done_envs)
+        players = self.current_player[envs]
+        count = self.puzzle_count[envs, players]
+        keep = (np.arange(MAX_PUZZLES) < count[:, None]) & ~done[envs]
+        order = np.argsort(~keep, axis=1, kind="stable")
+        rows = envs[:, None], players[:, None], order
+        kept = np.take_along_axis(keep, order, axis=1)
+        for values in [
+            self.puzzle_free,
+            self.puzzle_points,
+            self.puzzle_rewards,
+        ]:
+            values[envs, players] = np.where(kept, values[rows], 0)
+        self.puzzle_cells[envs, players] = np.where(
+            kept[:, :, None], self.puzzle_cells[rows], 0
+        )
+        self.puzzle_count[envs, players] = keep.sum(axis=1)
+
+    def fill_table_with_puzzles(self, next_turn: np.ndarray) -> None:
+        for slots, deck, deck_size in [
+            (range(4), self.black_deck, self.black_deck_size),
+            (range(4, TABLE_SLOTS), self.white_deck, self.white_deck_size),
+        ]:
+            for slot in slots:
+                fill = np.flatnonzero(
+                    next_turn & (self.table[:, slot] == NO_PUZZLE) & (deck_size > 0)
+                )
+                deck_size[fill] -= 1
+                self.table[fill, slot] = deck[fill, deck_size[fill]]
+
+    def reset_envs(self, envs: np.ndarray) -> None:
+        n = len(envs)
+        black_order = np.argsort(self.rng.random((n, len(black_puzzles))), axis=1)
+        white_order = np.argsort(self.rng.random((n, len(white_puzzles))), axis=1)
+        white_order += len(black_puzzles)
+
+        self.table[envs, :4] = black_order[:, :4]
+        self.table[envs, 4:] = white_order[:, :4]
+        self.black_deck[envs] = black_order[:, 4:]
+        self.white_deck[envs] = white_order[:, 4:]
+        self.black_deck_size[envs] = BLACK_DECK
+        self.white_deck_size[envs] = WHITE_DECK
+
+        self.inventories[envs] = 0
+        self.inventories[envs, :, piece_index[Piece.DOT]] = 1
+        self.inventories[envs, :, piece_index[Piece.GREEN]] = 1
+        self.points[envs] = 0
+        self.puzzle_count[envs] = 0
+        self.puzzle_free[envs] = 0
+        self.puzzle_cells[envs] = 0
+        self.puzzle_points[envs] = 0
+        self.puzzle_rewards[envs] = 0
+
+        self.current_player[envs] = 0
+        self.remaining_actions[envs] = 3
+        self.remaining_rounds[envs] = NO_ROUNDS
+        self.points_to_pay[envs] = 0
+        self.did_master_action[envs] = False
+        self.update()
+
+    def update(self) -> None:
+        self.write_legal_masks()
+        self.write_observations()
+
+    def write_legal_masks(self) -> None:
+        # same rules as action_space.legal_action_mask
+        envs = self.envs
+        player = self.current_player
+        masks = self.legal_masks
+
+        # the games share most of their free masks, so the placements that
+        # fit are computed once per distinct mask
+        has_piece = self.inventories[envs, player] > 0
+        free, puzzle_of_slot = np.unique(
+            self.puzzle_free[envs, player], return_inverse=True
+        )
+        fits = (free[:, None] & placement_masks32) == placement_masks32
+        np.bitwise_and(
+            fits[puzzle_of_slot.reshape(self.num_envs, MAX_PUZZLES)].view(np.uint8),
+            has_piece[:, None, placement_pieces].view(np.uint8),
+            out=self.place_masks,
+        )
+
+        last_round = self.remaining_rounds == 0
+        masks[:, STOP_ID] = last_round
+
+        other = ~last_round
+        can_take = self.puzzle_count[envs, player] < MAX_PUZZLES
+        masks[:, :TABLE_SLOTS] = (self.table != NO_PUZZLE) & (can_take & other)[:, None]
+        masks[:, GET_DOT_ID] = other
+        masks[:, UPGRADE_PIECE_OFFSET:PLACE_PIECE_OFFSET] = (
+            has_piece[:, upgrade_from_pieces] & other[:, None]
+        )
+
+        masks[:, MASTER_SLOT_OFFSET:] = False
+        if self.master_slots:
+            # every puzzle needs a placement that fits for a MASTER action
+            count = self.puzzle_count[envs, player]
+            present = np.arange(MAX_PUZZLES) < count[:, None]
+            fitting = self.place_masks.any(axis=2) | ~present
+            candidates = other & ~self.did_master_action & (count > 0)
+            for env in np.flatnonzero(candidates & fitting.all(axis=1)).tolist():
+                slot_actions = master_slot_actions(self.to_game(env))
+                self.master_actions[env] = slot_actions
+                masks[
+                    env, MASTER_SLOT_OFFSET : MASTER_SLOT_OFFSET + len(slot_actions)
+                ] = True
+
+    def write_observations(self) -> None:
+        # same layout as observation.encode_observation
+        n, players = self.num_envs, self.player_quantity
+        layout = observation_layout(players)
+        out = self.observations
+        envs = self.envs[:, None]
+        # players in turn order starting with the current one
+        order = (self.current_player[:, None] + np.arange(players)) % players
+
+        planes = out[:, layout.puzzle_planes].reshape(
+            n, players, MAX_PUZZLES, 2, BOARD_CELLS
+        )
+        planes[:, :, :, 0] = self.puzzle_free[envs, order][..., None] >> cell_bits & 1
+        planes[:, :, :, 1] = self.puzzle_cells[envs, order] >= Piece.DOT.value
+
+        table_present = self.table != NO_PUZZLE
+        table = np.where(table_present, self.table, 0)
+        out[:, layout.table_planes].reshape(n, TABLE_SLOTS, BOARD_CELLS)[:] = (
+            np.where(table_present, puzzle_free[table], 0)[..., None] >> cell_bits & 1
+        )
+
+        info = out[:, layout.puzzle_info].reshape(n, players, MAX_PUZZLES, PUZZLE_INFO)
+        info[..., 0] = (
+            np.arange(MAX_PUZZLES) < self.puzzle_count[envs, order][..., None]
+        )
+        info[..., 1] = self.puzzle_points[envs, order]
+        info[..., 2] = np.where(
+            info[..., 0] > 0, piece_sizes[self.puzzle_rewards[envs, order]], 0
+        )
+
+        table_info = out[:, layout.table_info].reshape(n, TABLE_SLOTS, PUZZLE_INFO)
+        table_info[..., 0] = table_present
+        table_info[..., 1] = np.where(table_present, puzzle_points[table], 0)
+        table_info[..., 2] = np.where(
+            table_present, piece_sizes[puzzle_rewards[table]], 0
+        )
+
+        out[:, layout.inventories] = self.inventories[envs, order].reshape(n, -1)
+        out[:, layout.points] = self.points[envs, order]
+
+        counters = out[:, layout.counters]
+        counters[:, 0] = self.remaining_actions
+        counters[:, 1] = self.points_to_pay
+        counters[:, 2] = self.black_deck_size
+        counters[:, 3] = self.white_deck_size
+        counters[:, 4] = self.did_master_action
+        counters[:, 5:] = self.remaining_rounds[:, None] == np.array(
+            [NO_ROUNDS if phase is None else phase for phase in PHASES]
+        )
+
+    def to_game(self, env: int) -> ProjectLGame:
+        game = ProjectLGame.__new__(ProjectLGame)
+        game.player_quantity = self.player_quantity
+        game.black_puzzles = [
+            None if p == NO_PUZZLE else all_puzzles[p] for p in self.table[env, :4]
+        ]
+        game.white_puzzles = [
+            None if p == NO_PUZZLE else all_puzzles[p] for p in self.table[env, 4:]
+        ]
+        game.black_deck = array("b", self.black_deck[env].tolist())
+        game.white_deck = array(
+            "b", (self.white_deck[env] - len(black_puzzles)).tolist()
+        )
+        game.black_deck_size = int(self.black_deck_size[env])
+        game.white_deck_size = int(self.white_deck_size[env])
+        game.inventories = array("i", self.inventories[env].ravel().tolist())
+        game.players_points = array("i", self.points[env].tolist())
+        game.players_puzzles = []
+        pieces = list(Piece)
+        for player in range(self.player_quantity):
+            puzzles: typing.List[Puzzle] = []
+            for slot in range(self.puzzle_count[env, player]):
+                puzzle = Puzzle.__new__(Puzzle)
+                puzzle.free = int(self.puzzle_free[env, player, slot])
+                puzzle.cells = sum(
+                    int(value) << (4 * cell)
+                    for cell, value in enumerate(self.puzzle_cells[env, player, slot])
+                )
+                puzzle.points = int(self.puzzle_points[env, player, slot])
+                puzzle.reward = pieces[self.puzzle_rewards[env, player, slot]]
+                puzzles.append(puzzle)
+            game.players_puzzles.append(puzzles)
+        game.current_player = int(self.current_player[env])
+        game.remaining_actions = int(self.remaining_actions[env])
+        game.did_master_action = bool(self.did_master_action[env])
+        remaining_rounds = int(self.remaining_rounds[env])
+        game.remaining_rounds = (
+            None if remaining_rounds == NO_ROUNDS else remaining_rounds
+        )
+        game.points_to_pay = int(self.points_to_pay[env])
+        game.rehash()
+        return game
+
+
+if __name__ == "__main__":
+    for num_envs in [256, 1024, 4096]:
+        env = BatchProjectLEnv(num_envs, seed=0)
+        rng = np.random.default_rng(0)
+        elapsed = 0.0
+        for _ in range(100):
+            # a random legal action for every game
+            actions = (rng.random(env.legal_masks.shape) * env.legal_masks).argmax(1)
+            begin = time.perf_counter()
+            env.step(actions)
+            elapsed += time.perf_counter() - begin
+        print(f"{num_envs:5} envs: {100 * num_envs / elapsed:10.0f} steps/s")
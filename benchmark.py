@@ -0,0 +1,283 @@
+import json
+import platform
+import random
+import sys
+import time
+import timeit
+import typing
+
+from action_space import (
+    MASTER_OFFSET,
+    decode_action,
+    decode_compact_action,
+    legal_actions,
+)
+from compute_actions import (
+    compute,
+    compute_all_get_dot,
+    compute_all_master,
+    compute_all_place_piece,
+    compute_all_take_puzzle,
+    compute_all_upgrade_piece,
+    iter_all_master,
+)
+from game_adapter import GameStateWriter, json_of_game_state
+from piece import Piece
+from projectl import ProjectLGame, ActionData, ActionEnum, compact_action
+from puzzle import black_puzzles, white_puzzles
+
+# Every result is a record {"benchmark", "position", "us", "count"} with the
+# microseconds per operation (best of a few runs) and, when it makes sense,
+# how many things the operation produced. `python3 benchmark.py [path]`
+# writes them as JSON (to stdout without a path) so two commits can be
+# compared record by record.
+
+SEEDS = 3
+DEPTHS = [0, 20, 60, 120]
+MASTER_LIMIT = 2000
+REPEAT = 3
+
+Result = typing.Dict[str, typing.Any]
+
+
+def record_game(
+    seed: int, steps: int
+) -> typing.Tuple[ProjectLGame, typing.List[ActionData]]:
+    random.seed(seed)
+    game = ProjectLGame(2)
+    start = game.copy()
+    actions: typing.List[ActionData] = []
+    for _ in range(steps):
+        possible_actions = compute(game)
+        if len(possible_actions) == 0:
+            break
+        (action, _) = random.choice(possible_actions)
+        game.step(action)
+        actions.append(action)
+    return start, actions
+
+
+def random_position(seed: int, depth: int) -> ProjectLGame:
+    random.seed(seed)
+    game = ProjectLGame(2)
+    for _ in range(depth):
+        if game.remaining_rounds == -1:
+            break
+        game.step_fast(decode_compact_action(random.choice(legal_actions(game))))
+    return game
+
+
+def master_position(
+    puzzles: typing.Sequence[typing.Any], quantity: int
+) -> ProjectLGame:
+    # the 4 puzzles with more free cells and quantity pieces of every type
+    random.seed(0)
+    game = ProjectLGame(2)
+    biggest = sorted(puzzles, key=lambda p: -bin(p.free).count("1"))[:4]
+    game.set_player_puzzles(0, [puzzle.copy() for puzzle in biggest])
+    for piece in Piece:
+        game.players_pieces[(0, piece)] = quantity
+    return game
+
+
+def corpus() -> typing.Dict[str, ProjectLGame]:
+    positions = {
+        f"seed{seed}-depth{depth}": random_position(seed, depth)
+        for seed in range(SEEDS)
+        for depth in DEPTHS
+    }
+    positions["master-black-3"] = master_position(black_puzzles, 3)
+    positions["master-white-5"] = master_position(white_puzzles, 5)
+    return positions
+
+
+def time_call(call: typing.Callable[[], typing.Any]) -> float:
+    timer = timeit.Timer(call)
+    number, _ = timer.autorange()
+    return min(timer.repeat(REPEAT, number)) / number * 1e6
+
+
+def result(
+    benchmark: str,
+    position: typing.Optional[str],
+    us: float,
+    count: typing.Optional[int] = None,
+) -> Result:
+    return {"benchmark": benchmark, "position": position, "us": us, "count": count}
+
+
+def bench_positions(positions: typing.Dict[str, ProjectLGame]) -> typing.List[Result]:
+    results: typing.List[Result] = []
+    generators: typing.Dict[str, typing.Callable[[ProjectLGame], typing.List]] = {
+        "compute_all_get_dot": compute_all_get_dot,
+        "compute_all_take_puzzle": compute_all_take_puzzle,
+        "compute_all_upgrade_piece": compute_all_upgrade_piece,
+        "compute_all_place_piece": compute_all_place_piece,
+        "compute_all_master": lambda game: compute_all_master(game, limit=MASTER_LIMIT),
+    }
+    writer = GameStateWriter()
+    for name, game in positions.items():
+        state = game.extract_state()
+        results.append(result("copy", name, time_call(game.copy)))
+        results.append(result("extract_state", name, time_call(game.extract_state)))
+        results.append(
+            result(
+                "json_of_game_state", name, time_call(lambda: json_of_game_state(state))
+            )
+        )
+        # serialization from the game, the old path against GameStateWriter
+        results.append(
+            result(
+                "state/json_of_game_state",
+                name,
+                time_call(lambda: json_of_game_state(game.extract_state())),
+                len(json_of_game_state(state)),
+            )
+        )
+        results.append(
+            result(
+                "state/writer_json",
+                name,
+                time_call(lambda: writer.json(game)),
+                len(writer.json(game)),
+            )
+        )
+        results.append(
+            result(
+                "state/writer_binary",
+                name,
+                time_call(lambda: writer.binary(game)),
+                len(writer.binary(game)),
+            )
+        )
+        for benchmark, generator in generators.items():
+            count = len(generator(game))
+            results.append(
+                result(benchmark, name, time_call(lambda: generator(game)), count)
+            )
+        master_count = sum(1 for _ in iter_all_master(game, limit=MASTER_LIMIT))
+        results.append(
+            result(
+                "iter_all_master",
+                name,
+                time_call(
+                    lambda: sum(1 for _ in iter_all_master(game, limit=MASTER_LIMIT))
+                ),
+                master_count,
+            )
+        )
+        if not name.startswith("master"):
+            # every MASTER action of the worst positions is too much to list
+            count = len(compute(game))
+            results.append(
+                result("compute", name, time_call(lambda: compute(game)), count)
+            )
+    return results
+
+
+def action_positions(
+    samples: int = 50,
+) -> typing.Dict[str, typing.List[typing.Tuple[ProjectLGame, ActionData]]]:
+    # positions of random games with one of their legal actions, samples of
+    # each ActionEnum: MASTER where one is legal and STOP from the last round,
+    # only one position per game, so games are played until there are enough
+    positions: typing.Dict[str, typing.List[typing.Tuple[ProjectLGame, ActionData]]]
+    positions = {kind.name: [] for kind in ActionEnum}
+    seed = 0
+    while any(len(kind) < samples for kind in positions.values()):
+        random.seed(seed)
+        seed += 1
+        game = ProjectLGame(2)
+        while game.remaining_rounds != -1:
+            master_limit = int(len(positions["MASTER"]) < samples)
+            action_ids = legal_actions(game, master_limit)
+            for action_id in action_ids:
+                action = decode_action(action_id)
+                kind = positions[ActionEnum(action["action"]).name]
+                if len(kind) < samples:
+                    kind.append((game.copy(), action))
+            action_ids = [i for i in action_ids if i < MASTER_OFFSET]
+            game.step_fast(decode_compact_action(random.choice(action_ids)))
+    return positions
+
+
+def bench_steps(seeds: int = SEEDS, steps: int = 60) -> typing.List[Result]:
+    # replays of recorded games, and step by type of action on their own
+    # copies of the positions so the replays are timed without them
+    results: typing.List[Result] = []
+    replays = [record_game(seed, steps) for seed in range(seeds)]
+    steppers: typing.List[
+        typing.Tuple[str, typing.Callable[[ProjectLGame, typing.Any], typing.Any], bool]
+    ] = [
+        ("replay/step", ProjectLGame.step, False),
+        ("replay/play", ProjectLGame.play, False),
+        ("replay/step_fast", ProjectLGame.step_fast, True),
+    ]
+    for benchmark, step, compact in steppers:
+        total, count = 0.0, 0
+        for start, actions in replays:
+            replayed: typing.List[typing.Any] = actions
+            if compact:
+                replayed = [compact_action(action) for action in actions]
+            best = float("inf")
+            for _ in range(REPEAT * 5):
+                game = start.copy()
+                begin = time.perf_counter()
+                for action in replayed:
+                    step(game, action)
+                best = min(best, time.perf_counter() - begin)
+            total, count = total + best, count + len(actions)
+        results.append(result(benchmark, None, total / count * 1e6, count))
+
+    for kind, pairs in action_positions().items():
+        best = float("inf")
+        for _ in range(REPEAT):
+            games = [game.copy() for game, _ in pairs]
+            begin = time.perf_counter()
+            for game, (_, action) in zip(games, pairs):
+                game.step(action)
+            best = min(best, time.perf_counter() - begin)
+        results.append(
+            result(f"step/{kind}", None, best / len(pairs) * 1e6, len(pairs))
+        )
+    return results
+
+
+def bench_games(games: int = 5) -> typing.List[Result]:
+    # whole games with random legal actions (no MASTER) through step_fast
+    # and through step with dictionaries
+    results: typing.List[Result] = []
+    for benchmark, fast in [("game/step_fast", True), ("game/step", False)]:
+        steps = 0
+        begin = time.perf_counter()
+        for seed in range(games):
+            random.seed(seed)
+            game = ProjectLGame(2)
+            while game.remaining_rounds != -1:
+                action_id = random.choice(legal_actions(game))
+                if fast:
+                    game.step_fast(decode_compact_action(action_id))
+                else:
+                    game.step(decode_action(action_id))
+                steps += 1
+        elapsed = time.perf_counter() - begin
+        results.append(result(benchmark, None, elapsed / games * 1e6, steps // games))
+    return results
+
+
+def run() -> typing.Dict[str, typing.Any]:
+    results = [*bench_positions(corpus()), *bench_steps(), *bench_games()]
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    report = json.dumps(run(), indent=2)
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as file:
+            file.write(report + "\n")
+    else:
+        print(report)
@@ -0,0 +1,227 @@
+import struct
+import typing
+from array import array
+
+from piece import Piece, PIECE_TYPES, BOARD_CELLS
+from puzzle import Puzzle, black_puzzles, white_puzzles
+from projectl import ProjectLGame
+
+# Binary form of a game, used to move states between processes without
+# pickling the object graph:
+#
+#   header      player_quantity, current_player, remaining_actions, flags
+#               (bit 0 did_master_action, bit 1 remaining_rounds is None),
+#               remaining_rounds, points_to_pay, black/white deck sizes
+#   table       8 bytes, index in black_puzzles/white_puzzles or NO_PUZZLE
+#   players     per player: points (signed, a STOP in the last round can
+#               leave them negative), PIECE_TYPES inventory bytes, puzzles
+#               count and then one PUZZLE record per puzzle
+#   decks       the remaining black and white deck indexes
+#
+# A PUZZLE record is a byte with the points in bits 0 .. 2 and the reward
+# (piece index) in bits 3 .. 6, followed by the 25 cells as 4-bit values
+# packed in 13 bytes. The free mask is not stored, free cells are the ones
+# with value 0.
+
+HEADER = struct.Struct("<BBBBbBBB")
+PLAYER = struct.Struct(f"<h{PIECE_TYPES}sB")
+PUZZLE = struct.Struct("<B13s")
+NO_PUZZLE = 0xFF
+TABLE_SIZE = 8
+
+# the free bits of the 2 cells of a byte of packed cells
+free_pairs = [int(byte & 0xF == 0) | int(byte >> 4 == 0) << 1 for byte in range(256)]
+
+pieces = list(Piece)
+black_indexes = {id(puzzle): i for i, puzzle in enumerate(black_puzzles)}
+white_indexes = {id(puzzle): i for i, puzzle in enumerate(white_puzzles)}
+
+
+def encode_puzzle(puzzle: Puzzle) -> bytes:
+    if puzzle.points >= 8:
+        raise ValueError(f"{puzzle.points} points do not fit in a puzzle record")
+    return PUZZLE.pack(
+        puzzle.points | pieces.index(puzzle.reward) << 3,
+        puzzle.cells.to_bytes(13, "little"),
+    )
+
+
+def decode_puzzle(data: bytes, offset: int) -> Puzzle:
+    info, cells = PUZZLE.unpack_from(data, offset)
+    puzzle = Puzzle.__new__(Puzzle)
+    free = 0
+    for i, byte in enumerate(cells):
+        free |= free_pairs[byte] << 2 * i
+    puzzle.free = free & (1 << BOARD_CELLS) - 1
+    puzzle.cells = int.from_bytes(cells, "little")
+    puzzle.points = info & 0x7
+    puzzle.reward = pieces[info >> 3]
+    return puzzle
+
+
+def table_index(puzzle: typing.Optional[Puzzle], indexes: typing.Dict[int, int]) -> int:
+    if puzzle is None:
+        return NO_PUZZLE
+    if id(puzzle) not in indexes:
+        raise ValueError("Table puzzles must come from black_puzzles/white_puzzles")
+    return indexes[id(puzzle)]
+
+
+def encode_game(game: ProjectLGame) -> bytes:
+    flags = int(game.did_master_action) | int(game.remaining_rounds is None) << 1
+    parts = [
+        HEADER.pack(
+            game.player_quantity,
+            game.current_player,
+            game.remaining_actions,
+            flags,
+            game.remaining_rounds or 0,
+            game.points_to_pay,
+            game.black_deck_size,
+            game.white_deck_size,
+        ),
+        bytes(table_index(p, black_indexes) for p in game.black_puzzles),
+        bytes(table_index(p, white_indexes) for p in game.white_puzzles),
+    ]
+    for player in range(game.player_quantity):
+        start = player * PIECE_TYPES
+        puzzles = game.players_puzzles[player]
+        parts.append(
+            PLAYER.pack(
+                game.players_points[player],
+                bytes(game.inventories[start : start + PIECE_TYPES].tolist()),
+                len(puzzles),
+            )
+        )
+        parts.extend(encode_puzzle(puzzle) for puzzle in puzzles)
+    parts.append(game.black_deck[: game.black_deck_size].tobytes())
+    parts.append(game.white_deck[: game.white_deck_size].tobytes())
+    return b"".join(parts)
+
+
+def decode_game(data: bytes) -> ProjectLGame:
+    game = ProjectLGame.__new__(ProjectLGame)
+    (
+        game.player_quantity,
+        game.current_player,
+        game.remaining_actions,
+        flags,
+        remaining_rounds,
+        game.points_to_pay,
+        game.black_deck_size,
+        game.white_deck_size,
+    ) = HEADER.unpack_from(data, 0)
+    game.did_master_action = bool(flags & 1)
+    game.remaining_rounds = None if flags & 2 else remaining_rounds
+    offset = HEADER.size
+
+    table = data[offset : offset + TABLE_SIZE]
+    game.black_puzzles = [
+        None if i == NO_PUZZLE else black_puzzles[i] for i in table[:4]
+    ]
+    game.white_puzzles = [
+        None if i == NO_PUZZLE else white_puzzles[i] for i in table[4:]
+    ]
+    offset += TABLE_SIZE
+
+    game.inventories = array("i")
+    game.players_points = array("i")
+    game.players_puzzles = []
+    for _ in range(game.player_quantity):
+        points, inventory, puzzles_count = PLAYER.unpack_from(data, offset)
+        offset += PLAYER.size
+        game.players_points.append(points)
+        game.inventories.extend(inventory)
+        puzzles: typing.List[Puzzle] = []
+        for _ in range(puzzles_count):
+            puzzles.append(decode_puzzle(data, offset))
+            offset += PUZZLE.size
+        game.players_puzzles.append(puzzles)
+
+    game.black_deck = array("b", data[offset : offset + game.black_deck_size])
+    offset += game.black_deck_size
+    game.white_deck = array("b", data[offset : offset + game.white_deck_size])
+
+    game.rehash()
+    return game
+
+
+# GAME LOGS
+#
+# A file with LOG_HEADER (magic and LOG_VERSION) and then the games one
+# after the other, each one as its size (RECORD_SIZE) and its encode_game
+# bytes. LOG_VERSION changes whenever the layout above changes.
+
+LOG_MAGIC = b"PJLG"
+LOG_VERSION = 3
+LOG_HEADER = struct.Struct("<4sB")
+RECORD_SIZE = struct.Struct("<H")
+
+
+def write_game_log(file: typing.BinaryIO, games: typing.Iterable[ProjectLGame]) -> int:
+    file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION))
+    written = 0
+    for game in games:
+        data = encode_game(game)
+        file.write(RECORD_SIZE.pack(len(data)))
+        file.write(data)
+        written += 1
+    return written
+
+
+def read_game_log(file: typing.BinaryIO) -> typing.Iterator[ProjectLGame]:
+    header = file.read(LOG_HEADER.size)
+    if len(header) != LOG_HEADER.size:
+        raise ValueError("Not a game log, the header is incomplete")
+    magic, version = LOG_HEADER.unpack(header)
+    if magic != LOG_MAGIC:
+        raise ValueError("Not a game log")
+    if version != LOG_VERSION:
+        raise ValueError(f"Game log version {version}, expected {LOG_VERSION}")
+    record = 0
+    while True:
+        size = file.read(RECORD_SIZE.size)
+        if len(size) == 0:
+            return
+        if len(size) != RECORD_SIZE.size:
+            raise ValueError(f"Truncated game log, record {record} has no full size")
+        (length,) = RECORD_SIZE.unpack(size)
+        data = file.read(length)
+        if len(data) != length:
+            raise ValueError(
+                f"Truncated game log, record {record} has {len(data)} of {length} bytes"
+            )
+        try:
+            game = decode_game(data)
+        except (struct.error, IndexError) as e:
+            raise ValueError(f"Corrupt game log, record {record}: {e}") from e
+        yield game
+        record += 1
+
+
+if __name__ == "__main__":
+    import io
+    import random
+
+    from action_space import decode_compact_action, legal_actions
+
+    games: typing.List[ProjectLGame] = []
+    for seed in range(20):
+        random.seed(seed)
+        game = ProjectLGame(2)
+        while game.remaining_rounds != -1:
+            games.append(game.copy())
+            game.step_fast(decode_compact_action(random.choice(legal_actions(game))))
+
+    sizes = [len(game.to_bytes()) for game in games]
+    for game in games:
+        assert ProjectLGame.from_bytes(game.to_bytes()).hash() == game.hash()
+    log = io.BytesIO()
+    write_game_log(log, games)
+    log.seek(0)
+    assert [game.hash() for game in read_game_log(log)] == [g.hash() for g in games]
+    print(
+        f"{len(games)} states, {sum(sizes) / len(sizes):.1f} bytes on average, "
+        f"{max(sizes)} at most, log {len(log.getvalue()) / len(games):.1f} "
+        "bytes per state"
+    )
@@ -0,0 +1,209 @@
+import functools
+import os
+import time
+import typing
+
+import numpy as np
+
+import solver
+from piece import BOARD_CELLS, PIECE_TYPES, placements
+from puzzle import black_puzzles, white_puzzles
+
+# Offline table with every way of completing every fill state the shipped
+# puzzles can reach. A way of completing is a piece multiset packed in 32
+# bits, one field per piece index big enough for the most pieces of that
+# type that fit in a board. The table is a directory of .npy files that are
+# memory mapped the first time they are needed:
+#
+#   masks       every reachable free mask
+#   offsets     multisets[offsets[i] : offsets[i + 1]] complete masks[i],
+#               sorted by number of pieces
+#   multisets   the packed multisets
+#   table       open addressing hash table from a mask to its row in masks
+#
+# Build it with `make completions` (`python3 completions.py`). Without it
+# can_complete falls back to solver.can_complete.
+
+COMPLETIONS_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "completions"
+)
+EMPTY_SLOT = -1
+
+field_bits = [(BOARD_CELLS // size).bit_length() for size in solver.sizes]
+field_shifts = [sum(field_bits[:i]) for i in range(PIECE_TYPES)]
+field_masks = [(1 << bits) - 1 for bits in field_bits]
+
+
+class Completions(typing.NamedTuple):
+    masks: np.ndarray
+    offsets: np.ndarray
+    multisets: np.ndarray
+    table: np.ndarray
+
+
+def pack_inventory(inventory: typing.Sequence[int]) -> int:
+    return sum(quantity << shift for quantity, shift in zip(inventory, field_shifts))
+
+
+def unpack_inventory(multiset: int) -> solver.Inventory:
+    return tuple(
+        multiset >> shift & mask for shift, mask in zip(field_shifts, field_masks)
+    )
+
+
+def table_slot(mask: int, table_bits: int) -> int:
+    return (mask * 0x9E3779B1 & 0xFFFFFFFF) >> (32 - table_bits)
+
+
+# BUILD
+
+
+def reachable_masks() -> typing.List[int]:
+    seen = {puzzle.free for puzzle in [*white_puzzles, *black_puzzles]}
+    stack = list(seen)
+    while len(stack) > 0:
+        mask = stack.pop()
+        for placement in placements:
+            if mask & placement.mask == placement.mask:
+                rest = mask & ~placement.mask
+                if rest not in seen:
+                    seen.add(rest)
+                    stack.append(rest)
+    return sorted(seen)
+
+
+def build_completions(masks: typing.Sequence[int]) -> Completions:
+    memo: typing.Dict[int, np.ndarray] = {0: np.zeros(1, dtype=np.uint32)}
+
+    def multisets_of(mask: int) -> np.ndarray:
+        if mask in memo:
+            return memo[mask]
+        low_cell = (mask & -mask).bit_length() - 1
+        parts = [
+            multisets_of(mask & ~placement_mask) + np.uint32(1 << field_shifts[piece])
+            for placement_mask, piece in solver.placements_by_low_cell[low_cell]
+            if mask & placement_mask == placement_mask
+        ]
+        memo[mask] = (
+            np.unique(np.concatenate(parts))
+            if len(parts) > 0
+            else np.zeros(0, dtype=np.uint32)
+        )
+        return memo[mask]
+
+    offsets = [0]
+    rows: typing.List[np.ndarray] = []
+    for mask in masks:
+        multisets = multisets_of(mask)
+        pieces = sum(
+            multisets >> np.uint32(shift) & np.uint32(field_mask)
+            for shift, field_mask in zip(field_shifts, field_masks)
+        )
+        rows.append(multisets[np.argsort(pieces, kind="stable")])
+        offsets.append(offsets[-1] + len(multisets))
+
+    # at most half full, so the probes stay short
+    table_bits = (2 * len(masks)).bit_length()
+    table = np.full(1 << table_bits, EMPTY_SLOT, dtype=np.int32)
+    for row, mask in enumerate(masks):
+        slot = table_slot(mask, table_bits)
+        while table[slot] != EMPTY_SLOT:
+            slot = (slot + 1) & (len(table) - 1)
+        table[slot] = row
+
+    return Completions(
+        np.array(masks, dtype=np.uint32),
+        np.array(offsets, dtype=np.uint32),
+        np.concatenate(rows),
+        table,
+    )
+
+
+def save_completions(completions: Completions, path: str = COMPLETIONS_PATH) -> None:
+    os.makedirs(path, exist_ok=True)
+    for name, array in completions._asdict().items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+
+
+# LOOKUP
+
+
+@functools.lru_cache(maxsize=None)
+def load_completions(path: str = COMPLETIONS_PATH) -> typing.Optional[Completions]:
+    # None when the table has not been built
+    if not all(
+        os.path.exists(os.path.join(path, f"{name}.npy"))
+        for name in Completions._fields
+    ):
+        return None
+    return Completions(
+        *[
+            np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in Completions._fields
+        ]
+    )
+
+
+def lookup(puzzle_mask: int) -> typing.Optional[np.ndarray]:
+    # the packed multisets that complete puzzle_mask, None if it isn't a
+    # fill state of the shipped puzzles or there is no table
+    completions = load_completions()
+    if completions is None:
+        return None
+    table = completions.table
+    table_bits = len(table).bit_length() - 1
+    slot = table_slot(puzzle_mask, table_bits)
+    while True:
+        row = int(table[slot])
+        if row == EMPTY_SLOT:
+            return None
+        if completions.masks[row] == puzzle_mask:
+            return completions.multisets[
+                completions.offsets[row] : completions.offsets[row + 1]
+            ]
+        slot = (slot + 1) & (len(table) - 1)
+
+
+def completions_of(puzzle_mask: int) -> typing.List[solver.Inventory]:
+    if load_completions() is None:
+        raise FileNotFoundError(
+            f"No completions table in {COMPLETIONS_PATH}, run `make completions`"
+        )
+    multisets = lookup(puzzle_mask)
+    if multisets is None:
+        raise KeyError(f"{puzzle_mask:#x} is not a fill state of the shipped puzzles")
+    return [unpack_inventory(int(multiset)) for multiset in multisets]
+
+
+def can_complete(
+    puzzle_mask: int, inventory: typing.Sequence[int]
+) -> typing.Tuple[bool, int]:
+    # same answers as solver.can_complete, which is still used for puzzles
+    # that are not in the table
+    multisets = lookup(puzzle_mask)
+    if multisets is None:
+        return solver.can_complete(puzzle_mask, inventory)
+
+    if len(multisets) == 0:
+        return False, 0
+    available = np.ones(len(multisets), dtype=bool)
+    for quantity, shift, field_mask in zip(inventory, field_shifts, field_masks):
+        available &= multisets >> np.uint32(shift) & np.uint32(field_mask) <= quantity
+    # the multisets are sorted by number of pieces
+    first = int(np.argmax(available))
+    if not available[first]:
+        return False, 0
+    return True, sum(unpack_inventory(int(multisets[first])))
+
+
+if __name__ == "__main__":
+    begin = time.perf_counter()
+    masks = reachable_masks()
+    completions = build_completions(masks)
+    save_completions(completions)
+    print(
+        f"{len(completions.masks)} fill states, "
+        f"{len(completions.multisets)} multisets, "
+        f"{sum(a.nbytes for a in completions) / 2**20:.1f} MiB "
+        f"in {time.perf_counter() - begin:.1f} s"
+    )
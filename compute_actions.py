@@ -7,16 +7,28 @@ from projectl import (
     VisibleState,
     piece_size,
     Puzzle,
+    compact_action,
+)
+from piece import (
+    undirectional_pieces,
+    reversable_pieces,
+    cell_index,
+    placement_of,
+    fitting_placements,
+    Placement,
 )
-from piece import undirectional_pieces, reversable_pieces
 import typing
-import itertools
+import time
 
 
 def build_action_for_get_dot() -> ActionData:
     return {"action": ActionEnum.GET_DOT.value, "action_data": {}}
 
 
+def build_action_for_stop() -> ActionData:
+    return {"action": ActionEnum.STOP.value, "action_data": {}}
+
+
 def build_action_for_take_puzzle(which_puzzle: int) -> ActionData:
     return {
         "action": ActionEnum.TAKE_PUZZLE.value,
@@ -75,21 +87,27 @@ def get_empty_position(
     )
 
 
-def try_action(
-    game: ProjectLGame, action_data: ActionData
-) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
-    fake_game = game.copy()
-    empty_white_positions = get_empty_position(
-        fake_game, action_data, fake_game.white_puzzles
-    )
-    empty_black_positions = get_empty_position(
-        fake_game, action_data, fake_game.black_puzzles
-    )
+def fits(free: int, placement: typing.Optional[Placement]) -> bool:
+    return placement is not None and free & placement.mask == placement.mask
+
 
+def is_legal(game: ProjectLGame, action_data: ActionData) -> bool:
     try:
-        visible_state, __, _ = fake_game.step(action_data)
+        record = game.apply(compact_action(action_data))
     except Exception as e:
-        return []
+        return False
+
+    game.undo(record)
+    return True
+
+
+def successor_state(game: ProjectLGame, action_data: ActionData) -> VisibleState:
+    empty_white_positions = get_empty_position(game, action_data, game.white_puzzles)
+    empty_black_positions = get_empty_position(game, action_data, game.black_puzzles)
+
+    record = game.apply(compact_action(action_data))
+    visible_state = game.extract_state()
+    game.undo(record)
 
     modified_visible_state = visible_state.copy()
 
@@ -102,121 +120,249 @@ def try_action(
         None if i in empty_white_positions else p
         for i, p in enumerate(visible_state["white_puzzles"])
     ]
-    return [(action_data, modified_visible_state)]
+    return modified_visible_state
 
 
-def compute_all_get_dot(
-    game: ProjectLGame,
+def try_action(
+    game: ProjectLGame, action_data: ActionData
 ) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
-    return try_action(game, build_action_for_get_dot())
+    try:
+        return [(action_data, successor_state(game, action_data))]
+    except Exception as e:
+        return []
 
 
-def compute_all_take_puzzle(
-    game: ProjectLGame,
+def with_states(
+    game: ProjectLGame, actions: typing.Iterable[ActionData]
 ) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
+    return [(action, successor_state(game, action)) for action in actions]
 
-    return [
-        res
-        for i in range(8)
-        for res in try_action(game, build_action_for_take_puzzle(i))
-    ]
 
+# LAZY VERSIONS (the game must not change while they are being consumed)
 
-def compute_all_upgrade_piece(
-    game: ProjectLGame,
-) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
 
-    return [
-        res
-        for p1 in list(Piece)
-        if game.players_pieces[(game.current_player, p1)] > 0
-        for p2 in list(Piece)
-        for res in try_action(game, build_action_for_upgrade_piece(p1, p2))
-    ]
+def iter_get_dot(game: ProjectLGame) -> typing.Iterator[ActionData]:
+    action = build_action_for_get_dot()
+    if is_legal(game, action):
+        yield action
 
 
-def compute_place_piece(
-    game: ProjectLGame, piece: Piece, puzzle_num: int
-) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
+def iter_take_puzzle(game: ProjectLGame) -> typing.Iterator[ActionData]:
+    for i in range(8):
+        action = build_action_for_take_puzzle(i)
+        if is_legal(game, action):
+            yield action
 
-    if game.players_pieces[(game.current_player, piece)] <= 0:
-        return []
 
-    puzzle = game.players_puzzles[game.current_player][puzzle_num]
+def iter_upgrade_piece(game: ProjectLGame) -> typing.Iterator[ActionData]:
+    for p1 in list(Piece):
+        if game.players_pieces[(game.current_player, p1)] > 0:
+            for p2 in list(Piece):
+                action = build_action_for_upgrade_piece(p1, p2)
+                if is_legal(game, action):
+                    yield action
 
-    if (
-        len([(x, y) for x in range(5) for y in range(5) if puzzle.matrix[x][y] == 0])
-        < piece_size[piece]
-    ):
-        return []
+
+def fitting_labels(
+    free: int, piece: Piece, deduplicate: bool = False
+) -> typing.List[typing.Tuple[int, int, Rotation, bool]]:
+    if deduplicate:
+        return [
+            (p.x_coord, p.y_coord, p.rotation, p.reversed)
+            for p in fitting_placements(free, piece)
+        ]
 
     return [
-        res
+        (x_coord, y_coord, rot, rev)
         for x_coord in range(5)
         for y_coord in range(5)
-        if puzzle.matrix[x_coord][y_coord] == 0
+        if free >> cell_index(x_coord, y_coord) & 1
         for rot in ([Rotation.UP] if piece in undirectional_pieces else list(Rotation))
         for rev in ([False] if piece not in reversable_pieces else [False, True])
-        for res in try_action(
-            game,
-            build_action_for_place_piece(puzzle_num, piece, x_coord, y_coord, rot, rev),
-        )
+        if fits(free, placement_of.get((piece, rot, rev, x_coord, y_coord)))
     ]
 
 
-def compute_all_place_piece(
+def iter_place_piece(
+    game: ProjectLGame, piece: Piece, puzzle_num: int, deduplicate: bool = False
+) -> typing.Iterator[ActionData]:
+    # fitting_labels applies the same rules as place_piece, so there is no
+    # need to simulate the candidates
+
+    if game.players_pieces[(game.current_player, piece)] <= 0:
+        return
+
+    puzzle = game.players_puzzles[game.current_player][puzzle_num]
+
+    if puzzle.free.bit_count() < piece_size[piece]:
+        return
+
+    for x_coord, y_coord, rot, rev in fitting_labels(puzzle.free, piece, deduplicate):
+        yield build_action_for_place_piece(
+            puzzle_num, piece, x_coord, y_coord, rot, rev
+        )
+
+
+def iter_all_place_piece(
+    game: ProjectLGame, deduplicate: bool = False
+) -> typing.Iterator[ActionData]:
+    for piece in list(Piece):
+        if game.players_pieces[(game.current_player, piece)] > 0:
+            for puzzle_num in range(len(game.players_puzzles[game.current_player])):
+                yield from iter_place_piece(game, piece, puzzle_num, deduplicate)
+
+
+def iter_all_master(
     game: ProjectLGame,
-) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
+    deduplicate: bool = False,
+    limit: typing.Optional[int] = None,
+    time_budget: typing.Optional[float] = None,
+) -> typing.Iterator[ActionData]:
+    # one piece per puzzle, chosen puzzle by puzzle while keeping track of the
+    # pieces that are left, so every yielded action is valid for master_play
 
-    return [
-        res
-        for piece in list(Piece)
-        if game.players_pieces[(game.current_player, piece)] > 0
-        for puzzle_num in range(len(game.players_puzzles[game.current_player]))
-        for res in compute_place_piece(game, piece, puzzle_num)
+    if game.did_master_action:
+        return
+
+    player = game.current_player
+    puzzles = game.players_puzzles[player]
+    remaining = {piece: game.players_pieces[(player, piece)] for piece in list(Piece)}
+
+    if len(puzzles) == 0 or sum(remaining.values()) < len(puzzles):
+        return
+
+    options = [
+        [
+            (piece, place_actions)
+            for piece in list(Piece)
+            if remaining[piece] > 0
+            for place_actions in [
+                [
+                    build_action_for_place_piece(puzzle_num, piece, x, y, rot, rev)[
+                        "action_data"
+                    ]
+                    for x, y, rot, rev in fitting_labels(
+                        puzzle.free, piece, deduplicate
+                    )
+                ]
+            ]
+            if len(place_actions) > 0
+        ]
+        for puzzle_num, puzzle in enumerate(puzzles)
     ]
 
+    chosen: typing.List[typing.Dict[str, typing.Any]] = []
 
-def compute_all_master(
+    def can_finish(puzzle_num: int) -> bool:
+        return all(
+            any(remaining[piece] > 0 for piece, _ in puzzle_options)
+            for puzzle_options in options[puzzle_num:]
+        )
+
+    def search(puzzle_num: int) -> typing.Iterator[ActionData]:
+        if puzzle_num == len(options):
+            yield build_action_for_master(list(chosen))
+            return
+
+        for piece, place_actions in options[puzzle_num]:
+            if remaining[piece] == 0:
+                continue
+            remaining[piece] -= 1
+            if can_finish(puzzle_num + 1):
+                for place_action in place_actions:
+                    chosen.append(place_action)
+                    yield from search(puzzle_num + 1)
+                    chosen.pop()
+            remaining[piece] += 1
+
+    if not can_finish(0):
+        return
+
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    for count, action in enumerate(search(0), start=1):
+        yield action
+        if limit is not None and count >= limit:
+            return
+        if deadline is not None and time.perf_counter() >= deadline:
+            return
+
+
+def iter_actions(
+    game: ProjectLGame,
+    deduplicate: bool = False,
+    master_limit: typing.Optional[int] = None,
+    master_time_budget: typing.Optional[float] = None,
+) -> typing.Iterator[ActionData]:
+    yield from iter_get_dot(game)
+    yield from iter_take_puzzle(game)
+    yield from iter_upgrade_piece(game)
+    yield from iter_all_place_piece(game, deduplicate)
+    yield from iter_all_master(game, deduplicate, master_limit, master_time_budget)
+
+
+def iter_unique_states(
+    game: ProjectLGame, actions: typing.Iterable[ActionData]
+) -> typing.Iterator[ActionData]:
+    # keeps only the first action leading to each state (by game.hash())
+    seen: typing.Set[int] = set()
+    for action in actions:
+        record = game.apply(compact_action(action))
+        key = game.hash()
+        game.undo(record)
+        if key not in seen:
+            seen.add(key)
+            yield action
+
+
+# EAGER VERSIONS (every action together with the state it leads to)
+
+
+def compute_all_get_dot(
     game: ProjectLGame,
 ) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
+    return with_states(game, iter_get_dot(game))
 
-    if game.did_master_action:
-        return []
 
-    all_pieces = [
-        piece
-        for (player_num, piece), quantity in game.players_pieces.items()
-        if player_num == game.current_player
-        for _ in range(quantity)
-    ]
-    puzzle_quantity = len(game.players_puzzles[game.current_player])
+def compute_all_take_puzzle(
+    game: ProjectLGame,
+) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
+    return with_states(game, iter_take_puzzle(game))
 
-    if len(all_pieces) < puzzle_quantity:
-        return []
 
-    actions = [
-        build_action_for_master([action["action_data"] for action in action_per_puzzle])
-        for pieces in set(itertools.permutations(all_pieces, puzzle_quantity))
-        for action_per_puzzle in itertools.product(
-            *[
-                [act for act, _ in compute_place_piece(game, piece, puzzle_num)]
-                for puzzle_num, piece in enumerate(pieces)
-            ]
-        )
-    ]
+def compute_all_upgrade_piece(
+    game: ProjectLGame,
+) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
+    return with_states(game, iter_upgrade_piece(game))
 
-    return [res for action in actions for res in try_action(game, action)]
 
+def compute_place_piece(
+    game: ProjectLGame, piece: Piece, puzzle_num: int, deduplicate: bool = False
+) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
+    return with_states(game, iter_place_piece(game, piece, puzzle_num, deduplicate))
 
-def compute(game: ProjectLGame) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
 
-    output = [
-        *compute_all_get_dot(game),
-        *compute_all_take_puzzle(game),
-        *compute_all_upgrade_piece(game),
-        *compute_all_place_piece(game),
-        *compute_all_master(game),
-    ]
+def compute_all_place_piece(
+    game: ProjectLGame, deduplicate: bool = False
+) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
+    return with_states(game, iter_all_place_piece(game, deduplicate))
+
+
+def compute_all_master(
+    game: ProjectLGame,
+    deduplicate: bool = False,
+    limit: typing.Optional[int] = None,
+    time_budget: typing.Optional[float] = None,
+) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
+    return with_states(game, iter_all_master(game, deduplicate, limit, time_budget))
 
-    return output
+
+def compute(
+    game: ProjectLGame, deduplicate: bool = False, unique_states: bool = False
+) -> typing.List[typing.Tuple[ActionData, VisibleState]]:
+    # with deduplicate, placements that cover the same cells with the same
+    # piece (e.g. RED in any rotation) are listed only once, and with
+    # unique_states only one action is kept for each resulting state
+    actions = iter_actions(game, deduplicate)
+    if unique_states:
+        actions = iter_unique_states(game, actions)
+    return with_states(game, actions)
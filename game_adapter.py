@@ -1,8 +1,12 @@
-from functools import reduce
+from functools import lru_cache
 import json
-from typing import Dict, Tuple, TypeVar, cast
+from typing import Any, Dict, List, Optional, Tuple, TypeVar
 
-from projectl import VisibleState
+from codec import HEADER, PLAYER, PUZZLE, TABLE_SIZE, encode_puzzle, table_index
+from codec import black_indexes, white_indexes
+from piece import BOARD_SIZE, PIECE_TYPES, Piece
+from projectl import ProjectLGame, VisibleState
+from puzzle import Puzzle
 
 T = TypeVar("T")
 
@@ -11,21 +15,141 @@ def merge_tuple_tuple_in_dict(
     accumulator: Dict[T, Dict[T, T]],
     item: Tuple[Tuple[T, T], T],
 ) -> Dict[T, Dict[T, T]]:
+    # updates accumulator in place, folding with it stays linear
     ((k1, k2), value) = item
-    return {
-        **accumulator,
-        k1: {**(accumulator.get(k1) or {}), k2: value},
-    }
+    accumulator.setdefault(k1, {})[k2] = value
+    return accumulator
+
+
+def dict_of_game_state(game_state: VisibleState) -> Dict[str, Any]:
+    players_pieces: Dict[int, Dict[int, int]] = {}
+    for item in game_state["players_pieces"].items():
+        merge_tuple_tuple_in_dict(players_pieces, item)
+    return {**game_state, "players_pieces": players_pieces}
 
 
 def json_of_game_state(game_state: VisibleState) -> str:
-    return json.dumps(
-        {
-            **game_state,
-            "players_pieces": reduce(
-                merge_tuple_tuple_in_dict,
-                game_state["players_pieces"].items(),
-                cast(Dict[int, Dict[int, int]], {}),
-            ),
-        }
-    )
+    return json.dumps(dict_of_game_state(game_state))
+
+
+# FAST SERIALIZATION (straight from the game, without extract_state)
+#
+# GameStateWriter.json gives the same text as
+# json_of_game_state(game.extract_state()) and GameStateWriter.binary the
+# codec layout without the decks (only their sizes, which are in the header),
+# so clients never see the order of the remaining puzzles.
+
+piece_keys = [f'"{piece.value}": ' for piece in Piece]
+MAX_BINARY_SIZE = HEADER.size + TABLE_SIZE + 4 * (PLAYER.size + 4 * PUZZLE.size)
+
+
+@lru_cache(maxsize=1 << 16)
+def matrix_json(cells: int) -> str:
+    rows = [
+        "["
+        + ", ".join(
+            str(cells >> 4 * (x * BOARD_SIZE + y) & 0xF) for y in range(BOARD_SIZE)
+        )
+        for x in range(BOARD_SIZE)
+    ]
+    return "[" + "], ".join(rows) + "]]"
+
+
+@lru_cache(maxsize=1 << 16)
+def puzzle_json(cells: int, points: int, reward: int) -> str:
+    return f'{{"matrix": {matrix_json(cells)}, "points": {points}, "reward": {reward}}}'
+
+
+def optional_puzzle_json(puzzle: Optional[Puzzle]) -> str:
+    if puzzle is None:
+        return "null"
+    return puzzle_json(puzzle.cells, puzzle.points, puzzle.reward.value)
+
+
+class GameStateWriter:
+    def __init__(self) -> None:
+        # reused by every call
+        self.parts: List[str] = []
+        self.buffer = bytearray(MAX_BINARY_SIZE)
+
+    def json(self, game: ProjectLGame) -> str:
+        parts = self.parts
+        parts.clear()
+        append = parts.append
+        players = range(game.player_quantity)
+
+        append('{"black_puzzles": [')
+        append(", ".join(map(optional_puzzle_json, game.black_puzzles)))
+        append('], "white_puzzles": [')
+        append(", ".join(map(optional_puzzle_json, game.white_puzzles)))
+        append(f'], "black_puzzles_remaining": {game.black_deck_size}')
+        append(f', "white_puzzles_remaining": {game.white_deck_size}')
+
+        append(', "players_pieces": {')
+        inventories = game.inventories
+        for player in players:
+            if player > 0:
+                append(", ")
+            start = player * PIECE_TYPES
+            append(f'"{player}": {{')
+            append(
+                ", ".join(
+                    f"{key}{inventories[start + i]}" for i, key in enumerate(piece_keys)
+                )
+            )
+            append("}")
+
+        append('}, "players_points": {')
+        append(", ".join(f'"{p}": {game.players_points[p]}' for p in players))
+        append('}, "players_puzzles": {')
+        for player in players:
+            if player > 0:
+                append(", ")
+            append(f'"{player}": [')
+            append(", ".join(map(optional_puzzle_json, game.players_puzzles[player])))
+            append("]")
+
+        append(f'}}, "current_player": {game.current_player}')
+        append(f', "remaining_actions": {game.remaining_actions}')
+        append(', "did_master_action": ')
+        append("true" if game.did_master_action else "false")
+        append(', "remaining_rounds": ')
+        append("null" if game.remaining_rounds is None else str(game.remaining_rounds))
+        append(f', "points_to_pay": {game.points_to_pay}}}')
+        return "".join(parts)
+
+    def binary(self, game: ProjectLGame) -> bytes:
+        buffer = self.buffer
+        HEADER.pack_into(
+            buffer,
+            0,
+            game.player_quantity,
+            game.current_player,
+            game.remaining_actions,
+            int(game.did_master_action) | int(game.remaining_rounds is None) << 1,
+            game.remaining_rounds or 0,
+            game.points_to_pay,
+            game.black_deck_size,
+            game.white_deck_size,
+        )
+        offset = HEADER.size
+        for i, puzzle in enumerate(game.black_puzzles):
+            buffer[offset + i] = table_index(puzzle, black_indexes)
+        for i, puzzle in enumerate(game.white_puzzles):
+            buffer[offset + 4 + i] = table_index(puzzle, white_indexes)
+        offset += TABLE_SIZE
+        for player in range(game.player_quantity):
+            start = player * PIECE_TYPES
+            puzzles = game.players_puzzles[player]
+            PLAYER.pack_into(
+                buffer,
+                offset,
+                game.players_points[player],
+                bytes(game.inventories[start : start + PIECE_TYPES].tolist()),
+                len(puzzles),
+            )
+            offset += PLAYER.size
+            for puzzle in puzzles:
+                buffer[offset : offset + PUZZLE.size] = encode_puzzle(puzzle)
+                offset += PUZZLE.size
+        return bytes(buffer[:offset])
@@ -0,0 +1,176 @@
+import concurrent.futures
+import queue
+import threading
+import time
+import typing
+
+import numpy as np
+
+from mcts import Evaluator, MCTSPlayer, SearchStats, outcome
+from observation import encode_observation, observation_size
+from projectl import ProjectLGame
+
+# Many searches (or games) asking for the evaluation of one observation at a
+# time are served by a single batched forward pass: requests wait in a queue
+# until max_batch_size of them are there or the oldest one waited max_wait
+# seconds. The model gets a (batch, observation size) float32 array and
+# returns an array, or a tuple of arrays, with one row per observation.
+
+Model = typing.Callable[[np.ndarray], typing.Any]
+Request = typing.Tuple[np.ndarray, concurrent.futures.Future]
+
+
+class InferenceStats(typing.NamedTuple):
+    requests: int
+    batches: int
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.requests / self.batches if self.batches > 0 else 0.0
+
+
+class InferenceQueue:
+    def __init__(
+        self, model: Model, max_batch_size: int = 64, max_wait: float = 0.002
+    ) -> None:
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        # None asks the serving thread to stop
+        self.requests: "queue.Queue[typing.Optional[Request]]" = queue.Queue()
+        self.stats = InferenceStats(0, 0)
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def submit(self, observation: np.ndarray) -> concurrent.futures.Future:
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self.requests.put((observation, future))
+        return future
+
+    def evaluate(self, observation: np.ndarray) -> typing.Any:
+        return self.submit(observation).result()
+
+    def close(self) -> None:
+        self.requests.put(None)
+        self.thread.join()
+
+    def __enter__(self) -> "InferenceQueue":
+        return self
+
+    def __exit__(self, *_: typing.Any) -> None:
+        self.close()
+
+    def serve(self) -> None:
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.perf_counter() + self.max_wait
+            closing = False
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    request = (
+                        self.requests.get(timeout=timeout)
+                        if timeout > 0
+                        else self.requests.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                batch.append(request)
+
+            self.run(batch)
+            if closing:
+                return
+
+    def run(self, batch: typing.List[Request]) -> None:
+        try:
+            outputs = self.model(np.stack([observation for observation, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.stats = InferenceStats(
+            self.stats.requests + len(batch), self.stats.batches + 1
+        )
+        for i, (_, future) in enumerate(batch):
+            if isinstance(outputs, tuple):
+                future.set_result(tuple(output[i] for output in outputs))
+            else:
+                future.set_result(outputs[i])
+
+
+def torch_model(module: typing.Any, device: str = "cpu") -> Model:
+    # torch is only needed when a torch module is used
+    import torch
+
+    module = module.to(device).eval()
+
+    def model(observations: np.ndarray) -> typing.Any:
+        with torch.no_grad():
+            outputs = module(torch.from_numpy(observations).to(device))
+        if isinstance(outputs, (tuple, list)):
+            return tuple(output.cpu().numpy() for output in outputs)
+        return outputs.cpu().numpy()
+
+    return model
+
+
+def first_value(output: typing.Any) -> float:
+    return float(np.ravel(output)[0])
+
+
+def value_evaluator(
+    inference: InferenceQueue,
+    value: typing.Callable[[typing.Any], float] = first_value,
+) -> Evaluator:
+    # MCTSPlayer evaluator from a model whose output (picked by value) is the
+    # value in [-1, 1] of the position for the current player
+    def evaluate(game: ProjectLGame) -> typing.List[float]:
+        if game.remaining_rounds == -1:
+            return outcome(game)
+        reward = (value(inference.evaluate(encode_observation(game))) + 1) / 2
+        rewards = [(1 - reward) / max(1, game.player_quantity - 1)] * (
+            game.player_quantity
+        )
+        rewards[game.current_player] = reward
+        return rewards
+
+    return evaluate
+
+
+def choose_many(
+    players: typing.Sequence[MCTSPlayer], games: typing.Sequence[ProjectLGame]
+) -> typing.List[typing.Tuple[int, SearchStats]]:
+    # one search per thread, so their evaluations share the batches
+    with concurrent.futures.ThreadPoolExecutor(len(games)) as executor:
+        return list(executor.map(MCTSPlayer.choose, players, games))
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    weights = rng.normal(size=(observation_size(2), 1)).astype(np.float32)
+
+    def linear_model(observations: np.ndarray) -> np.ndarray:
+        time.sleep(0.001)  # the cost of a forward pass, whatever its batch size
+        return np.tanh(observations @ weights * 0.01)
+
+    for searches in [1, 8, 32]:
+        with InferenceQueue(linear_model, max_batch_size=64) as inference:
+            evaluator = value_evaluator(inference)
+            players = [
+                MCTSPlayer(iterations=100, evaluator=evaluator, seed=i)
+                for i in range(searches)
+            ]
+            games = [ProjectLGame(2) for _ in range(searches)]
+            begin = time.perf_counter()
+            choose_many(players, games)
+            elapsed = time.perf_counter() - begin
+        print(
+            f"{searches:3} searches: {inference.stats.requests / elapsed:8.1f} "
+            f"evaluations/s, mean batch {inference.stats.mean_batch_size:5.1f}"
+        )
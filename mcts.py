@@ -0,0 +1,275 @@
+import math
+import random
+import time
+import typing
+from array import array
+
+import numpy as np
+
+from action_space import (
+    GET_DOT_ID,
+    PLACE_PIECE_OFFSET,
+    STOP_ID,
+    decode_compact_action,
+    legal_action_mask,
+    legal_actions,
+)
+from piece import Piece, PIECE_TYPES, piece_index, piece_size, placements
+from projectl import ProjectLGame
+
+RolloutPolicy = typing.Callable[[ProjectLGame, random.Random], int]
+# the reward of every player for a state, used instead of a rollout
+Evaluator = typing.Callable[[ProjectLGame], typing.List[float]]
+
+# ROLLOUT POLICIES (only the fixed size action space, MASTER is never chosen)
+
+
+def random_policy(game: ProjectLGame, rng: random.Random) -> int:
+    action_ids = np.flatnonzero(legal_action_mask(game))
+    return int(action_ids[rng.randrange(len(action_ids))])
+
+
+def greedy_policy(game: ProjectLGame, rng: random.Random) -> int:
+    # finish the best puzzle possible, otherwise keep placing pieces, then
+    # take puzzles and only then do anything else
+    action_ids = np.flatnonzero(legal_action_mask(game))
+    puzzles = game.players_puzzles[game.current_player]
+    place_ids = action_ids[
+        (action_ids >= PLACE_PIECE_OFFSET) & (action_ids < STOP_ID)
+    ].tolist()
+
+    best_id, best_points = None, -1
+    for action_id in place_ids:
+        puzzle_num, placement_index = divmod(
+            action_id - PLACE_PIECE_OFFSET, len(placements)
+        )
+        puzzle = puzzles[puzzle_num]
+        if placements[placement_index].mask == puzzle.free:
+            if puzzle.points > best_points:
+                best_id, best_points = action_id, puzzle.points
+    if best_id is not None:
+        return best_id
+
+    if game.remaining_rounds == 0:
+        return STOP_ID
+
+    if len(place_ids) > 0:
+        return rng.choice(place_ids)
+
+    take_ids = action_ids[action_ids < GET_DOT_ID].tolist()
+    if len(take_ids) > 0:
+        return rng.choice(take_ids)
+
+    return int(action_ids[rng.randrange(len(action_ids))])
+
+
+rollout_policies: typing.Dict[str, RolloutPolicy] = {
+    "random": random_policy,
+    "greedy": greedy_policy,
+}
+
+
+# SEARCH
+
+
+class SearchStats(typing.NamedTuple):
+    iterations: int
+    elapsed: float
+
+    @property
+    def iterations_per_second(self) -> float:
+        return self.iterations / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class Node:
+    # value is the sum of the rewards of the player that moved into the node
+    __slots__ = ("children", "visits", "value")
+
+    def __init__(self) -> None:
+        self.children: typing.Dict[int, "Node"] = {}
+        self.visits = 0
+        self.value = 0.0
+
+
+def determinize(game: ProjectLGame, rng: random.Random) -> ProjectLGame:
+    # the order of the remaining puzzles is hidden, so every search iteration
+    # plays on a copy with both decks shuffled
+    determinized = game.clone()
+    black_deck = list(game.black_deck[: game.black_deck_size])
+    white_deck = list(game.white_deck[: game.white_deck_size])
+    rng.shuffle(black_deck)
+    rng.shuffle(white_deck)
+    determinized.black_deck = array("b", black_deck)
+    determinized.white_deck = array("b", white_deck)
+    return determinized
+
+
+def heuristic_scores(game: ProjectLGame) -> typing.List[float]:
+    # points, plus part of the points of the puzzles being filled and a bit
+    # for each cell worth of pieces, so unfinished rollouts still say something
+    scores: typing.List[float] = []
+    for player in range(game.player_quantity):
+        score = float(game.players_points[player])
+        if game.remaining_rounds != -1:
+            for puzzle in game.players_puzzles[player]:
+                filled = sum(value >= Piece.DOT.value for value in puzzle.values())
+                free = bin(puzzle.free).count("1")
+                score += 0.5 * puzzle.points * filled / (filled + free)
+            start = player * PIECE_TYPES
+            score += 0.05 * sum(
+                game.inventories[start + piece_index[piece]] * size
+                for piece, size in piece_size.items()
+            )
+        scores.append(score)
+    return scores
+
+
+def outcome(game: ProjectLGame) -> typing.List[float]:
+    scores = heuristic_scores(game)
+    best = max(scores)
+    winners = [player for player, score in enumerate(scores) if score == best]
+    return [
+        1 / len(winners) if player in winners else 0.0
+        for player in range(game.player_quantity)
+    ]
+
+
+class MCTSPlayer:
+    def __init__(
+        self,
+        iterations: typing.Optional[int] = None,
+        time_budget: typing.Optional[float] = None,
+        rollout_policy: typing.Union[str, RolloutPolicy] = "greedy",
+        exploration: float = 1.4,
+        max_rollout_steps: int = 100,
+        master_limit: typing.Optional[int] = 32,
+        evaluator: typing.Optional[Evaluator] = None,
+        seed: typing.Optional[int] = None,
+    ) -> None:
+        if iterations is None and time_budget is None:
+            raise ValueError("MCTS needs an iteration budget or a time budget")
+        self.iterations = iterations
+        self.time_budget = time_budget
+        self.rollout_policy = (
+            rollout_policies[rollout_policy]
+            if isinstance(rollout_policy, str)
+            else rollout_policy
+        )
+        self.exploration = exploration
+        self.max_rollout_steps = max_rollout_steps
+        self.master_limit = master_limit
+        self.evaluator = evaluator
+        self.rng = random.Random(seed)
+
+    def choose(self, game: ProjectLGame) -> typing.Tuple[int, SearchStats]:
+        root, stats = self.search(game)
+        if len(root.children) == 0:
+            raise ValueError("There is no action to choose")
+        action_id = max(root.children, key=lambda a: root.children[a].visits)
+        return action_id, stats
+
+    def search(self, game: ProjectLGame) -> typing.Tuple[Node, SearchStats]:
+        root = Node()
+        start = time.perf_counter()
+        deadline = None if self.time_budget is None else start + self.time_budget
+        iterations = 0
+        while (self.iterations is None or iterations < self.iterations) and (
+            deadline is None or time.perf_counter() < deadline
+        ):
+            self.iterate(root, determinize(game, self.rng))
+            iterations += 1
+        return root, SearchStats(iterations, time.perf_counter() - start)
+
+    def iterate(self, root: Node, game: ProjectLGame) -> None:
+        path = self.descend(root, game)
+        self.backpropagate(root, path, self.evaluate(game))
+
+    def evaluate(self, game: ProjectLGame) -> typing.List[float]:
+        if self.evaluator is None:
+            return self.rollout(game)
+        return self.evaluator(game)
+
+    def descend(
+        self, root: Node, game: ProjectLGame
+    ) -> typing.List[typing.Tuple[Node, int]]:
+        # selection and expansion, game ends up in the state of the last node
+        # of the path, which pairs every node with the player that moved into it
+        node = root
+        path: typing.List[typing.Tuple[Node, int]] = []
+
+        while game.remaining_rounds != -1:
+            action_ids = legal_actions(game, self.master_limit)
+            if len(action_ids) == 0:
+                break
+            player = game.current_player
+            untried = [a for a in action_ids if a not in node.children]
+            if len(untried) > 0:
+                action_id = self.rng.choice(untried)
+                child = node.children[action_id] = Node()
+                game.step_fast(decode_compact_action(action_id))
+                path.append((child, player))
+                break
+            # the same node can have different legal actions in different
+            # determinizations, so only the legal children compete
+            log_visits = math.log(node.visits)
+            action_id = max(
+                action_ids,
+                key=lambda a: self.upper_confidence_bound(node.children[a], log_visits),
+            )
+            node = node.children[action_id]
+            game.step_fast(decode_compact_action(action_id))
+            path.append((node, player))
+
+        return path
+
+    def backpropagate(
+        self,
+        root: Node,
+        path: typing.List[typing.Tuple[Node, int]],
+        rewards: typing.List[float],
+    ) -> None:
+        root.visits += 1
+        for visited, player in path:
+            visited.visits += 1
+            visited.value += rewards[player]
+
+    def upper_confidence_bound(self, node: Node, log_parent_visits: float) -> float:
+        return node.value / node.visits + self.exploration * math.sqrt(
+            log_parent_visits / node.visits
+        )
+
+    def rollout(self, game: ProjectLGame) -> typing.List[float]:
+        for _ in range(self.max_rollout_steps):
+            if game.remaining_rounds == -1:
+                break
+            game.step_fast(decode_compact_action(self.rollout_policy(game, self.rng)))
+        return outcome(game)
+
+
+if __name__ == "__main__":
+    game = ProjectLGame(2)
+    players = [MCTSPlayer(time_budget=0.5), MCTSPlayer(iterations=1, seed=1)]
+    latencies: typing.List[float] = []
+    rates: typing.List[float] = []
+
+    while game.remaining_rounds != -1:
+        player = game.current_player
+        begin = time.perf_counter()
+        action_id, stats = players[player].choose(game)
+        if player == 0:
+            latencies.append(time.perf_counter() - begin)
+            rates.append(stats.iterations_per_second)
+            print(
+                f"action {action_id:>6} | {latencies[-1] * 1000:7.1f} ms | "
+                f"{stats.iterations:5} iterations | "
+                f"{stats.iterations_per_second:7.1f} it/s"
+            )
+        game.step_fast(decode_compact_action(action_id))
+
+    latencies.sort()
+    print(f"points: {list(game.players_points)}")
+    print(
+        f"latency p50: {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+        f"p99: {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms, "
+        f"mean rate: {sum(rates) / len(rates):.1f} it/s"
+    )
@@ -0,0 +1,135 @@
+import functools
+import typing
+
+import numpy as np
+
+from action_space import MAX_PUZZLES
+from piece import BOARD_CELLS, PIECE_TYPES, Piece, piece_size
+from projectl import ProjectLGame
+
+# Model input for a game, a float32 vector seen from the current player, who
+# is always the first player of the observation:
+#
+#   puzzle_planes  players x 4 slots x (free cells, filled cells) x 25
+#   table_planes   8 slots (black then white) x free cells x 25
+#   puzzle_info    players x 4 slots x (present, points, reward size)
+#   table_info     8 slots x (present, points, reward size)
+#   inventories    players x PIECE_TYPES
+#   points         players
+#   counters       remaining_actions, points_to_pay, black and white deck
+#                  sizes, did_master_action and the phase one hot (no last
+#                  rounds yet, 2, 1 or 0 remaining rounds)
+#
+# BatchProjectLEnv writes the same layout from its arrays.
+
+TABLE_SLOTS = 8
+PUZZLE_INFO = 3
+COUNTERS = 9
+PHASES: typing.List[typing.Optional[int]] = [None, 2, 1, 0]
+
+
+class ObservationLayout(typing.NamedTuple):
+    puzzle_planes: slice
+    table_planes: slice
+    puzzle_info: slice
+    table_info: slice
+    inventories: slice
+    points: slice
+    counters: slice
+    size: int
+
+
+@functools.lru_cache(maxsize=None)
+def observation_layout(player_quantity: int) -> ObservationLayout:
+    start = 0
+
+    def block(size: int) -> slice:
+        nonlocal start
+        start += size
+        return slice(start - size, start)
+
+    return ObservationLayout(
+        puzzle_planes=block(player_quantity * MAX_PUZZLES * 2 * BOARD_CELLS),
+        table_planes=block(TABLE_SLOTS * BOARD_CELLS),
+        puzzle_info=block(player_quantity * MAX_PUZZLES * PUZZLE_INFO),
+        table_info=block(TABLE_SLOTS * PUZZLE_INFO),
+        inventories=block(player_quantity * PIECE_TYPES),
+        points=block(player_quantity),
+        counters=block(COUNTERS),
+        size=start,
+    )
+
+
+def observation_size(player_quantity: int) -> int:
+    return observation_layout(player_quantity).size
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def free_plane(free: int) -> np.ndarray:
+    return np.array([free >> cell & 1 for cell in range(BOARD_CELLS)], np.float32)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def filled_plane(cells: int) -> np.ndarray:
+    return np.array(
+        [cells >> (4 * cell) & 0xF >= Piece.DOT.value for cell in range(BOARD_CELLS)],
+        np.float32,
+    )
+
+
+def encode_observation(
+    game: ProjectLGame, out: typing.Optional[np.ndarray] = None
+) -> np.ndarray:
+    players = game.player_quantity
+    layout = observation_layout(players)
+    obs = np.zeros(layout.size, dtype=np.float32) if out is None else out
+    obs[:] = 0
+
+    planes = obs[layout.puzzle_planes].reshape(players, MAX_PUZZLES, 2, BOARD_CELLS)
+    info = obs[layout.puzzle_info].reshape(players, MAX_PUZZLES, PUZZLE_INFO)
+    inventories = obs[layout.inventories].reshape(players, PIECE_TYPES)
+    points = obs[layout.points]
+    for k in range(players):
+        player = (game.current_player + k) % players
+        for slot, puzzle in enumerate(game.players_puzzles[player]):
+            planes[k, slot, 0] = free_plane(puzzle.free)
+            planes[k, slot, 1] = filled_plane(puzzle.cells)
+            info[k, slot] = (1, puzzle.points, piece_size[puzzle.reward])
+        start = player * PIECE_TYPES
+        inventories[k] = game.inventories[start : start + PIECE_TYPES]
+        points[k] = game.players_points[player]
+
+    table_planes = obs[layout.table_planes].reshape(TABLE_SLOTS, BOARD_CELLS)
+    table_info = obs[layout.table_info].reshape(TABLE_SLOTS, PUZZLE_INFO)
+    for slot, table_puzzle in enumerate([*game.black_puzzles, *game.white_puzzles]):
+        if table_puzzle is not None:
+            table_planes[slot] = free_plane(table_puzzle.free)
+            table_info[slot] = (
+                1,
+                table_puzzle.points,
+                piece_size[table_puzzle.reward],
+            )
+
+    counters = obs[layout.counters]
+    counters[0] = game.remaining_actions
+    counters[1] = game.points_to_pay
+    counters[2] = game.black_deck_size
+    counters[3] = game.white_deck_size
+    counters[4] = game.did_master_action
+    if game.remaining_rounds in PHASES:
+        counters[5 + PHASES.index(game.remaining_rounds)] = 1
+
+    return obs
+
+
+def encode_observations(
+    games: typing.Sequence[ProjectLGame], out: typing.Optional[np.ndarray] = None
+) -> np.ndarray:
+    # all the games must have the same number of players
+    if len(games) == 0:
+        return np.zeros((0, 0), dtype=np.float32) if out is None else out
+    size = observation_size(games[0].player_quantity)
+    obs = np.zeros((len(games), size), dtype=np.float32) if out is None else out
+    for i, game in enumerate(games):
+        encode_observation(game, obs[i])
+    return obs
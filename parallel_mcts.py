@@ -0,0 +1,187 @@
+import concurrent.futures
+import os
+import random
+import time
+import typing
+
+from codec import decode_game, encode_game
+from mcts import MCTSPlayer, Node, SearchStats, determinize
+from projectl import ProjectLGame
+
+# Two ways of using a process pool for the search, states always travel as
+# codec bytes:
+#
+#   root   every worker grows its own tree from the same root and the visit
+#          counts of the root children are added up
+#   tree   one tree lives in this process and the workers run the rollouts
+#          of the selected leaves, a virtual loss on the pending paths keeps
+#          the next selections away from them
+
+Path = typing.List[typing.Tuple[Node, int]]
+
+worker_player: typing.Optional[MCTSPlayer] = None
+
+
+def init_worker(settings: typing.Dict[str, typing.Any]) -> None:
+    global worker_player
+    worker_player = MCTSPlayer(iterations=1, **settings)
+
+
+def search_root(
+    data: bytes, settings: typing.Dict[str, typing.Any], seed: int
+) -> typing.Tuple[typing.Dict[int, int], int]:
+    root, stats = MCTSPlayer(**settings, seed=seed).search(decode_game(data))
+    visits = {action_id: child.visits for action_id, child in root.children.items()}
+    return visits, stats.iterations
+
+
+def rollout_leaf(data: bytes) -> typing.List[float]:
+    assert worker_player is not None
+    return worker_player.rollout(decode_game(data))
+
+
+class ParallelMCTSPlayer:
+    def __init__(
+        self,
+        workers: typing.Optional[int] = None,
+        mode: str = "root",
+        iterations: typing.Optional[int] = None,
+        time_budget: typing.Optional[float] = None,
+        virtual_loss: int = 1,
+        in_flight: int = 2,
+        seed: typing.Optional[int] = None,
+        **settings: typing.Any,
+    ) -> None:
+        # settings are the other MCTSPlayer arguments, the rollout policy must
+        # be a name or a module level function so the workers can get it
+        if mode not in ["root", "tree"]:
+            raise ValueError(f"Unknown parallel MCTS mode {mode}")
+        if iterations is None and time_budget is None:
+            raise ValueError("MCTS needs an iteration budget or a time budget")
+        if mode == "tree" and virtual_loss < 1:
+            # pending children without visits would be selected with log(0)
+            raise ValueError(f"Virtual loss {virtual_loss} must be at least 1")
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        self.iterations = iterations
+        self.time_budget = time_budget
+        self.virtual_loss = virtual_loss
+        self.in_flight = in_flight
+        self.settings = settings
+        self.rng = random.Random(seed)
+        self.tree_player = MCTSPlayer(
+            iterations=iterations, time_budget=time_budget, seed=seed, **settings
+        )
+        self.executor: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+    def pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers, initializer=init_worker, initargs=(self.settings,)
+            )
+        return self.executor
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self) -> "ParallelMCTSPlayer":
+        return self
+
+    def __exit__(self, *_: typing.Any) -> None:
+        self.close()
+
+    def choose(self, game: ProjectLGame) -> typing.Tuple[int, SearchStats]:
+        if self.mode == "root":
+            visits, stats = self.search_root(game)
+        else:
+            visits, stats = self.search_tree(game)
+        if len(visits) == 0:
+            raise ValueError("There is no action to choose")
+        return max(visits, key=visits.__getitem__), stats
+
+    def search_root(
+        self, game: ProjectLGame
+    ) -> typing.Tuple[typing.Dict[int, int], SearchStats]:
+        start = time.perf_counter()
+        data = encode_game(game)
+        settings = {
+            **self.settings,
+            "iterations": None
+            if self.iterations is None
+            else -(-self.iterations // self.workers),
+            "time_budget": self.time_budget,
+        }
+        futures = [
+            self.pool().submit(search_root, data, settings, self.rng.getrandbits(32))
+            for _ in range(self.workers)
+        ]
+
+        visits: typing.Dict[int, int] = {}
+        iterations = 0
+        for future in futures:
+            worker_visits, worker_iterations = future.result()
+            iterations += worker_iterations
+            for action_id, count in worker_visits.items():
+                visits[action_id] = visits.get(action_id, 0) + count
+        return visits, SearchStats(iterations, time.perf_counter() - start)
+
+    def search_tree(
+        self, game: ProjectLGame
+    ) -> typing.Tuple[typing.Dict[int, int], SearchStats]:
+        start = time.perf_counter()
+        deadline = None if self.time_budget is None else start + self.time_budget
+        player = self.tree_player
+        root = Node()
+        pending: typing.Dict[concurrent.futures.Future, Path] = {}
+        started = iterations = 0
+
+        while True:
+            while (
+                len(pending) < self.workers * self.in_flight
+                and (self.iterations is None or started < self.iterations)
+                and (deadline is None or time.perf_counter() < deadline)
+            ):
+                state = determinize(game, player.rng)
+                path = player.descend(root, state)
+                self.add_virtual_loss(root, path, self.virtual_loss)
+                pending[self.pool().submit(rollout_leaf, encode_game(state))] = path
+                started += 1
+            if len(pending) == 0:
+                break
+
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                path = pending.pop(future)
+                self.add_virtual_loss(root, path, -self.virtual_loss)
+                player.backpropagate(root, path, future.result())
+                iterations += 1
+
+        visits = {action_id: child.visits for action_id, child in root.children.items()}
+        return visits, SearchStats(iterations, time.perf_counter() - start)
+
+    @staticmethod
+    def add_virtual_loss(root: Node, path: Path, loss: int) -> None:
+        # visits without reward make the pending paths look worse
+        root.visits += loss
+        for node, _ in path:
+            node.visits += loss
+
+
+if __name__ == "__main__":
+    game = ProjectLGame(2)
+    cores = os.cpu_count() or 1
+    workers_list = [2**i for i in range(cores.bit_length()) if 2**i <= cores]
+
+    for mode in ["root", "tree"]:
+        for workers in workers_list:
+            with ParallelMCTSPlayer(workers, mode, time_budget=2.0) as player:
+                player.choose(game)  # starts the workers
+                _, stats = player.choose(game)
+            print(
+                f"{mode:>4} | {workers:3} workers | {stats.iterations:6} playouts | "
+                f"{stats.iterations_per_second:8.1f} playouts/s"
+            )
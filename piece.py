@@ -53,6 +53,33 @@ Points = typing.List[Point]
 OrientationToPoints = typing.Dict[bool, Points]
 RotationAndOrientationToPoints = typing.Dict[Rotation, OrientationToPoints]
 
+PIECE_TYPES = len(Piece)
+
+piece_index = {piece: i for i, piece in enumerate(list(Piece))}
+
+BOARD_SIZE = 5
+BOARD_CELLS = BOARD_SIZE * BOARD_SIZE
+FULL_MASK = (1 << BOARD_CELLS) - 1
+
+
+def cell_index(x: int, y: int) -> int:
+    return x * BOARD_SIZE + y
+
+
+def coords_mask(coords: Points) -> typing.Optional[int]:
+    mask = 0
+    for x, y in coords:
+        if x < 0 or x >= BOARD_SIZE or y < 0 or y >= BOARD_SIZE:
+            return None
+        mask |= 1 << cell_index(x, y)
+    return mask
+
+
+def nibbles_of_mask(mask: int) -> int:
+    # one 4-bit slot per cell, with the low bit of every slot in `mask` set
+    return sum(1 << (4 * i) for i in range(BOARD_CELLS) if mask >> i & 1)
+
+
 reversable_pieces = [Piece.LSHAPE, Piece.LADDER]
 undirectional_pieces = [Piece.DOT, Piece.RED]
 
@@ -472,3 +499,67 @@ piece_formats: typing.Dict[Piece, RotationAndOrientationToPoints] = {
         },
     },
 }
+
+
+class Placement(typing.NamedTuple):
+    placement_id: int
+    piece: Piece
+    rotation: Rotation
+    reversed: bool
+    x_coord: int
+    y_coord: int
+    mask: int
+    cells: int
+
+
+PlacementLabel = typing.Tuple[Piece, Rotation, bool, int, int]
+
+
+def build_placements() -> typing.Tuple[
+    typing.List[Placement], typing.Dict[PlacementLabel, Placement]
+]:
+    # every label that fits in the board points to the first placement that
+    # covers the same cells, so symmetric rotations share a single entry
+    all_placements: typing.List[Placement] = []
+    by_label: typing.Dict[PlacementLabel, Placement] = {}
+    for piece in list(Piece):
+        by_mask: typing.Dict[int, Placement] = {}
+        for rotation in list(Rotation):
+            for reversed in [False, True]:
+                for x_coord in range(BOARD_SIZE):
+                    for y_coord in range(BOARD_SIZE):
+                        mask = coords_mask(
+                            [
+                                (x_coord + x, y_coord + y)
+                                for x, y in piece_formats[piece][rotation][reversed]
+                            ]
+                        )
+                        if mask is None:
+                            continue
+                        if mask not in by_mask:
+                            by_mask[mask] = Placement(
+                                len(all_placements),
+                                piece,
+                                rotation,
+                                reversed,
+                                x_coord,
+                                y_coord,
+                                mask,
+                                nibbles_of_mask(mask) * piece.value,
+                            )
+                            all_placements.append(by_mask[mask])
+                        by_label[
+                            (piece, rotation, reversed, x_coord, y_coord)
+                        ] = by_mask[mask]
+    return all_placements, by_label
+
+
+placements, placement_of = build_placements()
+
+piece_placements: typing.Dict[Piece, typing.List[Placement]] = {
+    piece: [p for p in placements if p.piece == piece] for piece in list(Piece)
+}
+
+
+def fitting_placements(free: int, piece: Piece) -> typing.List[Placement]:
+    return [p for p in piece_placements[piece] if free & p.mask == p.mask]
@@ -1,6 +1,16 @@
 import typing
-from piece import Piece, Rotation, piece_size, piece_formats
+from array import array
+from piece import (
+    Piece,
+    PIECE_TYPES,
+    piece_index,
+    Rotation,
+    piece_size,
+    piece_formats,
+    placement_of,
+)
 from puzzle import white_puzzles, black_puzzles, Puzzle, PuzzleData, print_puzzles
+import zobrist
 import random
 from enum import Enum
 from pydantic import BaseModel, validator
@@ -40,6 +50,10 @@ class ActionEnum(Enum):
     STOP = 6
 
 
+piece_values = [p.value for p in list(Piece)]
+rotation_values = [r.value for r in list(Rotation)]
+
+
 class CustomModel(BaseModel):
     class Config:
         orm_mode = True
@@ -62,7 +76,7 @@ class UpgradePieceAction(CustomModel):
 
     @validator("from_piece", "to_piece", pre=True)
     def parse_piece(cls, value: typing.Any) -> Piece:
-        if value not in [p.value for p in list(Piece)]:
+        if value not in piece_values:
             raise ValueError(f"{value} not in {list(Piece)}")
         return Piece(value)
 
@@ -83,7 +97,7 @@ class PlacePieceAction(CustomModel):
 
     @validator("piece", pre=True)
     def parse_piece(cls, value: typing.Any) -> Piece:
-        if value not in [p.value for p in list(Piece)]:
+        if value not in piece_values:
             raise ValueError(f"{value} not in {list(Piece)}")
         return Piece(value)
 
@@ -95,7 +109,7 @@ class PlacePieceAction(CustomModel):
 
     @validator("rotation", pre=True)
     def parse_rotation(cls, value: typing.Any) -> Rotation:
-        if value not in [p.value for p in list(Rotation)]:
+        if value not in rotation_values:
             raise ValueError(f"{value} not in {list(Rotation)}")
         return Rotation(value)
 
@@ -110,10 +124,196 @@ class MasterAction(CustomModel):
         return [PlacePieceAction(**v) for v in value]
 
 
+# TRUSTED TYPES (same fields as the models above, but without validation)
+
+
+class TakeData(typing.NamedTuple):
+    which_puzzle: int
+
+
+class UpgradePieceData(typing.NamedTuple):
+    from_piece: Piece
+    to_piece: Piece
+
+
+class PlacePieceData(typing.NamedTuple):
+    puzzle: int
+    piece: Piece
+    x_coord: int
+    y_coord: int
+    rotation: Rotation
+    reversed: bool
+
+
+class MasterData(typing.NamedTuple):
+    place_piece_actions: typing.List[PlacePieceData]
+
+
+class CompactAction(typing.NamedTuple):
+    action: ActionEnum
+    action_data: typing.Union[
+        None, TakeData, UpgradePieceData, PlacePieceData, MasterData
+    ] = None
+
+
+def parse_action(action: ActionData) -> CompactAction:
+    action_data = action["action_data"]
+
+    if action["action"] == ActionEnum.GET_DOT.value:
+        return CompactAction(ActionEnum.GET_DOT)
+
+    elif action["action"] == ActionEnum.UPGRADE_PIECE.value:
+        upgrade_data = UpgradePieceAction(**action_data)
+        return CompactAction(
+            ActionEnum.UPGRADE_PIECE,
+            UpgradePieceData(upgrade_data.from_piece, upgrade_data.to_piece),
+        )
+
+    elif action["action"] == ActionEnum.TAKE_PUZZLE.value:
+        take_data = TakeAction(**action_data)
+        return CompactAction(ActionEnum.TAKE_PUZZLE, TakeData(take_data.which_puzzle))
+
+    elif action["action"] == ActionEnum.PLACE_PIECE.value:
+        place_data = PlacePieceAction(**action_data)
+        return CompactAction(ActionEnum.PLACE_PIECE, place_data_of_model(place_data))
+
+    elif action["action"] == ActionEnum.MASTER.value:
+        master_data = MasterAction(**action_data)
+        return CompactAction(
+            ActionEnum.MASTER,
+            MasterData(
+                [place_data_of_model(ac) for ac in master_data.place_piece_actions]
+            ),
+        )
+
+    elif action["action"] == ActionEnum.STOP.value:
+        return CompactAction(ActionEnum.STOP)
+
+    raise ProjectLGame.InvalidAction(f"Invalid action: {action['action']}")
+
+
+def place_data_of_model(model: PlacePieceAction) -> PlacePieceData:
+    return PlacePieceData(
+        model.puzzle,
+        model.piece,
+        model.x_coord,
+        model.y_coord,
+        model.rotation,
+        model.reversed,
+    )
+
+
+def place_data_of_dict(action_data: typing.Dict[str, typing.Any]) -> PlacePieceData:
+    return PlacePieceData(
+        action_data["puzzle"],
+        Piece(action_data["piece"]),
+        action_data["x_coord"],
+        action_data["y_coord"],
+        Rotation(action_data["rotation"]),
+        action_data["reversed"],
+    )
+
+
+def compact_action(action: ActionData) -> CompactAction:
+    # only for actions built by this project, nothing here is validated
+    action_enum = ActionEnum(action["action"])
+    action_data = action["action_data"]
+
+    if action_enum == ActionEnum.UPGRADE_PIECE:
+        return CompactAction(
+            action_enum,
+            UpgradePieceData(
+                Piece(action_data["from_piece"]), Piece(action_data["to_piece"])
+            ),
+        )
+
+    elif action_enum == ActionEnum.TAKE_PUZZLE:
+        return CompactAction(action_enum, TakeData(action_data["which_puzzle"]))
+
+    elif action_enum == ActionEnum.PLACE_PIECE:
+        return CompactAction(action_enum, place_data_of_dict(action_data))
+
+    elif action_enum == ActionEnum.MASTER:
+        return CompactAction(
+            action_enum,
+            MasterData(
+                [place_data_of_dict(ac) for ac in action_data["place_piece_actions"]]
+            ),
+        )
+
+    return CompactAction(action_enum)
+
+
+class UndoRecord(typing.NamedTuple):
+    player: int
+    remaining_actions: int
+    did_master_action: bool
+    remaining_rounds: typing.Optional[int]
+    points_to_pay: int
+    points: int
+    pieces: "array[int]"
+    puzzles: typing.List[Puzzle]
+    fills: typing.Tuple[typing.Tuple[int, int], ...]
+    black_puzzles: typing.Tuple[typing.Optional[Puzzle], ...]
+    white_puzzles: typing.Tuple[typing.Optional[Puzzle], ...]
+    black_deck_size: int
+    white_deck_size: int
+    zobrist_key: int
+
+
+class PiecesView(typing.MutableMapping[typing.Tuple[int, Piece], int]):
+    # (player, piece) -> quantity, backed by ProjectLGame.inventories
+    __slots__ = ("game",)
+
+    def __init__(self, game: "ProjectLGame") -> None:
+        self.game = game
+
+    def __getitem__(self, key: typing.Tuple[int, Piece]) -> int:
+        player, piece = key
+        return self.game.inventories[player * PIECE_TYPES + piece_index[piece]]
+
+    def __setitem__(self, key: typing.Tuple[int, Piece], quantity: int) -> None:
+        player, piece = key
+        slot = player * PIECE_TYPES + piece_index[piece]
+        self.game.add_pieces(slot, quantity - self.game.inventories[slot])
+
+    def __delitem__(self, key: typing.Tuple[int, Piece]) -> None:
+        raise TypeError("Pieces cannot be removed from the inventory")
+
+    def __iter__(self) -> typing.Iterator[typing.Tuple[int, Piece]]:
+        return (
+            (player_num, piece)
+            for piece in list(Piece)
+            for player_num in range(self.game.player_quantity)
+        )
+
+    def __len__(self) -> int:
+        return len(self.game.inventories)
+
+
 class ProjectLGame:
     class InvalidAction(Exception):
         pass
 
+    __slots__ = (
+        "player_quantity",
+        "black_puzzles",
+        "white_puzzles",
+        "black_deck",
+        "white_deck",
+        "black_deck_size",
+        "white_deck_size",
+        "inventories",
+        "players_points",
+        "players_puzzles",
+        "current_player",
+        "remaining_actions",
+        "did_master_action",
+        "remaining_rounds",
+        "points_to_pay",
+        "zobrist_key",
+    )
+
     def __init__(
         self, player_quantity: int = 2, state: typing.Optional["ProjectLGame"] = None
     ) -> None:
@@ -125,66 +325,170 @@ class ProjectLGame:
 
     def reset(self):
 
-        shuffled_black_puzzles = black_puzzles.copy()
-        random.shuffle(shuffled_black_puzzles)
+        black_order = list(range(len(black_puzzles)))
+        random.shuffle(black_order)
 
-        shuffled_white_puzzles = white_puzzles.copy()
-        random.shuffle(shuffled_white_puzzles)
+        white_order = list(range(len(white_puzzles)))
+        random.shuffle(white_order)
 
-        self.black_puzzles = typing.cast(
-            typing.List[typing.Optional[Puzzle]], shuffled_black_puzzles[:4]
-        )
-        self.white_puzzles = typing.cast(
-            typing.List[typing.Optional[Puzzle]], shuffled_white_puzzles[:4]
+        self.black_puzzles: typing.List[typing.Optional[Puzzle]] = [
+            black_puzzles[i] for i in black_order[:4]
+        ]
+        self.white_puzzles: typing.List[typing.Optional[Puzzle]] = [
+            white_puzzles[i] for i in white_order[:4]
+        ]
+        # the decks hold indexes of black_puzzles/white_puzzles and are never
+        # changed in place (puzzles are drawn from the end by shrinking the
+        # size), so copies of the game can share them
+        self.black_deck = array("b", black_order[4:20])
+        self.white_deck = array("b", white_order[4:32])
+        self.black_deck_size = len(self.black_deck)
+        self.white_deck_size = len(self.white_deck)
+
+        # quantity of each piece, PIECE_TYPES entries per player
+        self.inventories = array(
+            "i",
+            [
+                1 if piece in [Piece.DOT, Piece.GREEN] else 0
+                for _ in range(self.player_quantity)
+                for piece in list(Piece)
+            ],
         )
-        self.black_puzzles_remaining = shuffled_black_puzzles[4:20]
-        self.white_puzzles_remaining = shuffled_white_puzzles[4:32]
-
-        self.players_pieces = {
-            (player_num, piece): 1 if piece in [Piece.DOT, Piece.GREEN] else 0
-            for piece in list(Piece)
-            for player_num in range(self.player_quantity)
-        }
-        self.players_points = {
-            player_num: 0 for player_num in range(self.player_quantity)
-        }
-        self.players_puzzles: typing.Dict[int, typing.List[Puzzle]] = {
-            player_num: [] for player_num in range(self.player_quantity)
-        }
+        self.players_points = array("i", [0] * self.player_quantity)
+        self.players_puzzles: typing.List[typing.List[Puzzle]] = [
+            [] for _ in range(self.player_quantity)
+        ]
         self.current_player: int = 0
         self.remaining_actions: int = 3
         self.did_master_action: bool = False
         self.remaining_rounds: typing.Optional[int] = None
         self.points_to_pay: int = 0
+        self.rehash()
 
     def set_state(self, state: "ProjectLGame") -> None:
 
-        self.black_puzzles = [p if p is None else p.copy() for p in state.black_puzzles]
-        self.white_puzzles = [p if p is None else p.copy() for p in state.white_puzzles]
-        self.black_puzzles_remaining = state.black_puzzles_remaining.copy()
-        self.white_puzzles_remaining = state.white_puzzles_remaining.copy()
-
-        self.players_pieces = {
-            (player_num, Piece(piece.value)): quantity
-            for (player_num, piece), quantity in state.players_pieces.items()
-        }
-        self.players_points = {
-            player_num: points for player_num, points in state.players_points.items()
-        }
-        self.players_puzzles = {
-            player_num: [puzzle.copy() for puzzle in puzzles]
-            for player_num, puzzles in state.players_puzzles.items()
-        }
-        self.current_player = int(state.current_player)
-        self.remaining_actions = int(state.remaining_actions)
-        self.did_master_action = bool(state.did_master_action)
-        self.remaining_rounds = (
-            None if state.remaining_rounds is None else int(state.remaining_rounds)
+        self.player_quantity = state.player_quantity
+        self.black_puzzles = state.black_puzzles.copy()
+        self.white_puzzles = state.white_puzzles.copy()
+        self.black_deck = state.black_deck
+        self.white_deck = state.white_deck
+        self.black_deck_size = state.black_deck_size
+        self.white_deck_size = state.white_deck_size
+
+        self.inventories = state.inventories[:]
+        self.players_points = state.players_points[:]
+        self.players_puzzles = [
+            [puzzle.copy() for puzzle in puzzles] for puzzles in state.players_puzzles
+        ]
+        self.current_player = state.current_player
+        self.remaining_actions = state.remaining_actions
+        self.did_master_action = state.did_master_action
+        self.remaining_rounds = state.remaining_rounds
+        self.points_to_pay = state.points_to_pay
+        self.zobrist_key: int = state.zobrist_key
+
+    def rehash(self) -> None:
+        # the hash of everything that is kept up to date by the game methods,
+        # for games built field by field (change the puzzles and the pieces
+        # of a game through set_player_puzzles, set_table_puzzle and
+        # players_pieces, which keep it up to date)
+        self.zobrist_key = 0
+        for player, puzzles in enumerate(self.players_puzzles):
+            for slot, puzzle in enumerate(puzzles):
+                self.zobrist_key ^= zobrist.puzzle_key(
+                    zobrist.player_owner(player, slot), puzzle
+                )
+        for which_puzzle, table_puzzle in enumerate(
+            [*self.black_puzzles, *self.white_puzzles]
+        ):
+            if table_puzzle is not None:
+                self.zobrist_key ^= zobrist.puzzle_key(
+                    zobrist.table_owner(which_puzzle), table_puzzle
+                )
+        for slot, quantity in enumerate(self.inventories):
+            self.zobrist_key ^= zobrist.inventory_key(slot, quantity)
+
+    def hash(self) -> int:
+        key = (
+            self.zobrist_key
+            ^ zobrist.current_player_keys[self.current_player]
+            ^ zobrist.remaining_actions_keys[self.remaining_actions]
+            ^ zobrist.points_to_pay_keys[self.points_to_pay % zobrist.COUNTER_KEYS]
+            ^ zobrist.black_deck_keys[self.black_deck_size]
+            ^ zobrist.white_deck_keys[self.white_deck_size]
         )
-        self.points_to_pay = int(state.points_to_pay)
+        if self.did_master_action:
+            key ^= zobrist.master_key
+        if self.remaining_rounds is None:
+            key ^= zobrist.no_rounds_key
+        else:
+            key ^= zobrist.remaining_rounds_keys[self.remaining_rounds + 1]
+        for player, points in enumerate(self.players_points):
+            key ^= zobrist.score_key(player, points)
+        return key
+
+    def add_pieces(self, slot: int, quantity: int) -> None:
+        old_quantity = self.inventories[slot]
+        self.inventories[slot] = old_quantity + quantity
+        self.zobrist_key ^= zobrist.inventory_key(
+            slot, old_quantity
+        ) ^ zobrist.inventory_key(slot, old_quantity + quantity)
+
+    def set_player_puzzles(self, player: int, puzzles: typing.List[Puzzle]) -> None:
+        for slot, puzzle in enumerate(self.players_puzzles[player]):
+            self.zobrist_key ^= zobrist.puzzle_key(
+                zobrist.player_owner(player, slot), puzzle
+            )
+        self.players_puzzles[player] = list(puzzles)
+        for slot, puzzle in enumerate(puzzles):
+            self.zobrist_key ^= zobrist.puzzle_key(
+                zobrist.player_owner(player, slot), puzzle
+            )
+
+    def set_table_puzzle(
+        self, which_puzzle: int, puzzle: typing.Optional[Puzzle]
+    ) -> None:
+        # which_puzzle 0 .. 3 black, 4 .. 7 white
+        table = self.black_puzzles if which_puzzle < 4 else self.white_puzzles
+        owner = zobrist.table_owner(which_puzzle)
+        old_puzzle = table[which_puzzle % 4]
+        if old_puzzle is not None:
+            self.zobrist_key ^= zobrist.puzzle_key(owner, old_puzzle)
+        table[which_puzzle % 4] = puzzle
+        if puzzle is not None:
+            self.zobrist_key ^= zobrist.puzzle_key(owner, puzzle)
+
+    def clone(self) -> "ProjectLGame":
+        game = ProjectLGame.__new__(ProjectLGame)
+        game.set_state(self)
+        return game
 
     def copy(self) -> "ProjectLGame":
-        return ProjectLGame(self.player_quantity, self)
+        return self.clone()
+
+    def to_bytes(self) -> bytes:
+        # the layout is in codec.py (which imports this module)
+        from codec import encode_game
+
+        return encode_game(self)
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "ProjectLGame":
+        from codec import decode_game
+
+        return decode_game(data)
+
+    @property
+    def players_pieces(self) -> PiecesView:
+        return PiecesView(self)
+
+    @property
+    def black_puzzles_remaining(self) -> typing.List[Puzzle]:
+        return [black_puzzles[i] for i in self.black_deck[: self.black_deck_size]]
+
+    @property
+    def white_puzzles_remaining(self) -> typing.List[Puzzle]:
+        return [white_puzzles[i] for i in self.white_deck[: self.white_deck_size]]
 
     def extract_state(self) -> VisibleState:
         return {
@@ -194,15 +498,17 @@ class ProjectLGame:
             "white_puzzles": [
                 p.extract_data() if p is not None else None for p in self.white_puzzles
             ],
-            "black_puzzles_remaining": len(self.black_puzzles_remaining),
-            "white_puzzles_remaining": len(self.white_puzzles_remaining),
+            "black_puzzles_remaining": self.black_deck_size,
+            "white_puzzles_remaining": self.white_deck_size,
             "players_pieces": {
-                (pl, pi.value): q for (pl, pi), q in self.players_pieces.items()
+                (pl, pi.value): self.inventories[pl * PIECE_TYPES + i]
+                for i, pi in enumerate(list(Piece))
+                for pl in range(self.player_quantity)
             },
-            "players_points": self.players_points,
+            "players_points": dict(enumerate(self.players_points)),
             "players_puzzles": {
                 p: [pu.extract_data() for pu in pus]
-                for p, pus in self.players_puzzles.items()
+                for p, pus in enumerate(self.players_puzzles)
             },
             "current_player": self.current_player,
             "remaining_actions": self.remaining_actions,
@@ -213,12 +519,13 @@ class ProjectLGame:
 
     def remove_done_puzzles(self) -> None:
         puzzles_to_remove: typing.List[int] = []
+        pieces_start = self.current_player * PIECE_TYPES
         for i, puzzle in enumerate(self.players_puzzles[self.current_player]):
-            if all(v != 0 for row in puzzle.matrix for v in row):
+            if puzzle.is_done():
                 self.players_points[self.current_player] += puzzle.points
-                self.players_pieces[(self.current_player, puzzle.reward)] += 1
-                all_positions = [v for row in puzzle.matrix for v in row]
-                for piece in list(Piece):
+                self.add_pieces(pieces_start + piece_index[puzzle.reward], 1)
+                all_positions = puzzle.values()
+                for j, piece in enumerate(list(Piece)):
                     piece_quantity_f = (
                         all_positions.count(piece.value) / piece_size[piece]
                     )
@@ -227,35 +534,56 @@ class ProjectLGame:
                         raise ProjectLGame.InvalidAction(
                             f"Some internal error appeared: {puzzle.matrix}"
                         )
-                    self.players_pieces[(self.current_player, piece)] += piece_quantity
+                    self.add_pieces(pieces_start + j, piece_quantity)
                 puzzles_to_remove.append(i)
+        if len(puzzles_to_remove) == 0:
+            return
+        for i, p in enumerate(self.players_puzzles[self.current_player]):
+            self.zobrist_key ^= zobrist.puzzle_key(
+                zobrist.player_owner(self.current_player, i), p
+            )
         self.players_puzzles[self.current_player] = [
             p
             for i, p in enumerate(self.players_puzzles[self.current_player])
             if i not in puzzles_to_remove
         ]
+        for i, p in enumerate(self.players_puzzles[self.current_player]):
+            self.zobrist_key ^= zobrist.puzzle_key(
+                zobrist.player_owner(self.current_player, i), p
+            )
 
     def fill_table_with_puzzles(self) -> None:
         for i in range(len(self.black_puzzles)):
-            if self.black_puzzles[i] is None and len(self.black_puzzles_remaining) > 0:
-                self.black_puzzles[i] = self.black_puzzles_remaining.pop()
+            if self.black_puzzles[i] is None and self.black_deck_size > 0:
+                self.black_deck_size -= 1
+                puzzle = black_puzzles[self.black_deck[self.black_deck_size]]
+                self.black_puzzles[i] = puzzle
+                self.zobrist_key ^= zobrist.puzzle_key(zobrist.table_owner(i), puzzle)
 
         for i in range(len(self.white_puzzles)):
-            if self.white_puzzles[i] is None and len(self.white_puzzles_remaining) > 0:
-                self.white_puzzles[i] = self.white_puzzles_remaining.pop()
+            if self.white_puzzles[i] is None and self.white_deck_size > 0:
+                self.white_deck_size -= 1
+                puzzle = white_puzzles[self.white_deck[self.white_deck_size]]
+                self.white_puzzles[i] = puzzle
+                self.zobrist_key ^= zobrist.puzzle_key(
+                    zobrist.table_owner(4 + i), puzzle
+                )
 
     def get_dot(self) -> None:
-        self.players_pieces[(self.current_player, Piece.DOT)] += 1
+        self.add_pieces(self.current_player * PIECE_TYPES + piece_index[Piece.DOT], 1)
 
-    def upgrade_piece(self, action_data: UpgradePieceAction) -> None:
+    def upgrade_piece(
+        self, action_data: typing.Union[UpgradePieceAction, UpgradePieceData]
+    ) -> None:
 
         from_piece = action_data.from_piece
         to_piece = action_data.to_piece
+        pieces_start = self.current_player * PIECE_TYPES
 
         if from_piece == to_piece:
             raise ProjectLGame.InvalidAction("You cannot upgrade a piece to itself")
 
-        if self.players_pieces[(self.current_player, from_piece)] == 0:
+        if self.inventories[pieces_start + piece_index[from_piece]] == 0:
             raise ProjectLGame.InvalidAction(
                 "You cannot upgrade a piece that you doesn't have"
             )
@@ -268,10 +596,10 @@ class ProjectLGame:
                 f"Bad piece upgrade ({from_piece_size} -> {to_piece_size})"
             )
 
-        self.players_pieces[(self.current_player, from_piece)] -= 1
-        self.players_pieces[(self.current_player, to_piece)] += 1
+        self.add_pieces(pieces_start + piece_index[from_piece], -1)
+        self.add_pieces(pieces_start + piece_index[to_piece], 1)
 
-    def get_puzzle(self, action_data: TakeAction) -> None:
+    def get_puzzle(self, action_data: typing.Union[TakeAction, TakeData]) -> None:
 
         if len(self.players_puzzles[self.current_player]) == 4:
             raise ProjectLGame.InvalidAction("You can take only 4 puzzles")
@@ -288,7 +616,7 @@ class ProjectLGame:
                     "You cannot get a puzzle that doesn't exists"
                 )
 
-            self.players_puzzles[self.current_player].append(puzzle.copy())
+            self.take_table_puzzle(which_puzzle, puzzle)
             self.black_puzzles[puzzle_pos] = None
 
         elif is_white:
@@ -298,7 +626,7 @@ class ProjectLGame:
                     "You cannot get a puzzle that doesn't exists"
                 )
 
-            self.players_puzzles[self.current_player].append(puzzle.copy())
+            self.take_table_puzzle(which_puzzle, puzzle)
             self.white_puzzles[puzzle_pos] = None
 
         else:
@@ -306,7 +634,20 @@ class ProjectLGame:
                 "You cannot get a puzzle that doesn't exists"
             )
 
-    def place_piece(self, action_data: PlacePieceAction, only_try=False) -> None:
+    def take_table_puzzle(self, which_puzzle: int, puzzle: Puzzle) -> None:
+        puzzles = self.players_puzzles[self.current_player]
+        self.zobrist_key ^= zobrist.puzzle_key(
+            zobrist.table_owner(which_puzzle), puzzle
+        ) ^ zobrist.puzzle_key(
+            zobrist.player_owner(self.current_player, len(puzzles)), puzzle
+        )
+        puzzles.append(puzzle.copy())
+
+    def place_piece(
+        self,
+        action_data: typing.Union[PlacePieceAction, PlacePieceData],
+        only_try=False,
+    ) -> None:
 
         if action_data.puzzle >= len(self.players_puzzles[self.current_player]):
             raise ProjectLGame.InvalidAction(
@@ -319,41 +660,43 @@ class ProjectLGame:
         reversed = action_data.reversed
         x_coord = action_data.x_coord
         y_coord = action_data.y_coord
+        piece_slot = self.current_player * PIECE_TYPES + piece_index[piece]
 
-        if self.players_pieces[(self.current_player, piece)] == 0:
+        if self.inventories[piece_slot] == 0:
             raise ProjectLGame.InvalidAction(
                 "You cannot place a piece that is not yours"
             )
 
-        available_coords = [
-            (i, j)
-            for i, row in enumerate(puzzle.matrix)
-            for j, value in enumerate(row)
-            if value == 0
-        ]
-
-        piece_format = piece_formats[piece][rotation][reversed]
-        necessary_coords = [(x_coord + x, y_coord + y) for x, y in piece_format]
+        placement = placement_of.get((piece, rotation, reversed, x_coord, y_coord))
 
-        if not all(coord in available_coords for coord in necessary_coords):
+        if placement is None or not puzzle.fits(placement.mask):
 
+            piece_format = piece_formats[piece][rotation][reversed]
+            necessary_coords = [(x_coord + x, y_coord + y) for x, y in piece_format]
             raise ProjectLGame.InvalidAction(
                 "Cannot place a piece in a filled space "
-                f"(necessary coords: {necessary_coords}, available coords: {available_coords})"
+                f"(necessary coords: {necessary_coords}, available coords: {puzzle.free_coords()})"
             )
 
         if not only_try:
-            self.players_pieces[(self.current_player, piece)] -= 1
-            for x, y in necessary_coords:
-                puzzle.matrix[x][y] = piece.value
+            self.add_pieces(piece_slot, -1)
+            puzzle.place(placement.mask, placement.cells)
+            self.zobrist_key ^= zobrist.placement_key(
+                zobrist.player_owner(self.current_player, action_data.puzzle),
+                placement.placement_id,
+            )
 
-    def master_play(self, action_data: MasterAction) -> None:
+    def master_play(self, action_data: typing.Union[MasterAction, MasterData]) -> None:
+
+        if self.did_master_action:
+            raise ProjectLGame.InvalidAction("Only one MASTER action per turn")
 
         puzzles = [ac.puzzle for ac in action_data.place_piece_actions]
         pieces = [ac.piece for ac in action_data.place_piece_actions]
+        pieces_start = self.current_player * PIECE_TYPES
         remaining_pieces = [
-            self.players_pieces[(self.current_player, p)] - pieces.count(p)
-            for p in list(Piece)
+            self.inventories[pieces_start + i] - pieces.count(p)
+            for i, p in enumerate(list(Piece))
         ]
         if any(r < 0 for r in remaining_pieces):
             raise ProjectLGame.InvalidAction(
@@ -380,47 +723,136 @@ class ProjectLGame:
             self.place_piece(ac)
 
     def step(self, action: ActionData) -> typing.Tuple[VisibleState, int, bool]:
+        self.play(action)
+        return (
+            self.extract_state(),
+            self.players_points[self.current_player],
+            self.remaining_rounds != -1,
+        )
+
+    def step_fast(self, action: CompactAction) -> typing.Tuple[int, bool]:
+        self.play_fast(action)
+        return self.players_points[self.current_player], self.remaining_rounds != -1
+
+    def apply(self, action: typing.Union[ActionData, CompactAction]) -> UndoRecord:
+        player = self.current_player
+        puzzles = self.players_puzzles[player]
+        record = UndoRecord(
+            player,
+            self.remaining_actions,
+            self.did_master_action,
+            self.remaining_rounds,
+            self.points_to_pay,
+            self.players_points[player],
+            self.inventories[player * PIECE_TYPES : (player + 1) * PIECE_TYPES],
+            puzzles,
+            tuple((puzzle.free, puzzle.cells) for puzzle in puzzles),
+            tuple(self.black_puzzles),
+            tuple(self.white_puzzles),
+            self.black_deck_size,
+            self.white_deck_size,
+            self.zobrist_key,
+        )
+        try:
+            if isinstance(action, CompactAction):
+                self.play_fast(action)
+            else:
+                self.play(action)
+        except Exception:
+            self.undo(record)
+            raise
+        return record
+
+    def undo(self, record: UndoRecord) -> None:
+        self.black_puzzles[:] = record.black_puzzles
+        self.white_puzzles[:] = record.white_puzzles
+        self.black_deck_size = record.black_deck_size
+        self.white_deck_size = record.white_deck_size
+
+        player = record.player
+        puzzles = record.puzzles
+        del puzzles[len(record.fills) :]
+        for puzzle, (free, cells) in zip(puzzles, record.fills):
+            puzzle.free = free
+            puzzle.cells = cells
+        self.players_puzzles[player] = puzzles
+
+        self.inventories[
+            player * PIECE_TYPES : (player + 1) * PIECE_TYPES
+        ] = record.pieces
+        self.players_points[player] = record.points
+        self.current_player = player
+        self.remaining_actions = record.remaining_actions
+        self.did_master_action = record.did_master_action
+        self.remaining_rounds = record.remaining_rounds
+        self.points_to_pay = record.points_to_pay
+        self.zobrist_key = record.zobrist_key
+
+    def play(self, action: ActionData) -> None:
+        if self.remaining_rounds == -1:
+            return
+
+        if self.remaining_rounds == 0 and action["action"] not in [
+            ActionEnum.PLACE_PIECE.value,
+            ActionEnum.STOP.value,
+        ]:
+            # the other actions are ignored in the last round
+            self.end_action()
+            return
+
+        try:
+            compact = parse_action(action)
+        except TypeError as e:
+            # action_data that is not a mapping of keyword arguments
+            raise ProjectLGame.InvalidAction(
+                f"Invalid action data: {action['action_data']!r}"
+            ) from e
+        self.play_fast(compact)
+
+    def play_fast(self, action: CompactAction) -> None:
         if self.remaining_rounds == -1:
-            return self.extract_state(), self.players_points[self.current_player], False
+            return
+
+        action_data = action.action_data
 
         if self.remaining_rounds == 0:
 
-            if action["action"] == ActionEnum.PLACE_PIECE.value:
-                place_data = PlacePieceAction(**action["action_data"])
-                self.place_piece(place_data)
+            if action.action == ActionEnum.PLACE_PIECE:
+                self.place_piece(typing.cast(PlacePieceData, action_data))
                 self.points_to_pay += 1
 
-            elif action["action"] == ActionEnum.STOP.value:
+            elif action.action == ActionEnum.STOP:
                 self.players_points[self.current_player] -= self.points_to_pay
                 self.points_to_pay = 0
                 self.remaining_actions = 0
 
         else:
 
-            if action["action"] == ActionEnum.GET_DOT.value:
+            if action.action == ActionEnum.GET_DOT:
                 self.get_dot()
 
-            elif action["action"] == ActionEnum.UPGRADE_PIECE.value:
-                upgrade_data = UpgradePieceAction(**action["action_data"])
-                self.upgrade_piece(upgrade_data)
+            elif action.action == ActionEnum.UPGRADE_PIECE:
+                self.upgrade_piece(typing.cast(UpgradePieceData, action_data))
 
-            elif action["action"] == ActionEnum.TAKE_PUZZLE.value:
-                take_data = TakeAction(**action["action_data"])
-                self.get_puzzle(take_data)
+            elif action.action == ActionEnum.TAKE_PUZZLE:
+                self.get_puzzle(typing.cast(TakeData, action_data))
 
-            elif action["action"] == ActionEnum.PLACE_PIECE.value:
-                place_data = PlacePieceAction(**action["action_data"])
-                self.place_piece(place_data)
+            elif action.action == ActionEnum.PLACE_PIECE:
+                self.place_piece(typing.cast(PlacePieceData, action_data))
 
-            elif action["action"] == ActionEnum.MASTER.value:
-                master_data = MasterAction(**action["action_data"])
-                self.master_play(master_data)
+            elif action.action == ActionEnum.MASTER:
+                self.master_play(typing.cast(MasterData, action_data))
 
             else:
-                raise ProjectLGame.InvalidAction(f"Invalid action: {action['action']}")
+                raise ProjectLGame.InvalidAction(
+                    f"Invalid action: {action.action.value}"
+                )
 
             self.remaining_actions -= 1
 
+        self.end_action()
+
+    def end_action(self) -> None:
         self.remove_done_puzzles()
 
         if self.remaining_actions == 0:
@@ -434,17 +866,12 @@ class ProjectLGame:
         if self.current_player == self.player_quantity:
             self.current_player = 0
 
-        if len(self.black_puzzles_remaining) == 0:
+        if self.black_deck_size == 0:
             if self.remaining_rounds is None:
                 self.remaining_rounds = 2
             elif self.current_player == 0:
                 self.remaining_rounds -= 1
 
-        if self.remaining_rounds == -1:
-            return self.extract_state(), self.players_points[self.current_player], False
-
-        return self.extract_state(), self.players_points[self.current_player], True
-
     def render(self):
 
         for player in range(self.player_quantity):
@@ -465,9 +892,9 @@ class ProjectLGame:
             print_puzzles(self.players_puzzles[player])
 
         print("BLACK PUZZLES:")
-        print(f"remaining: {len(self.black_puzzles_remaining)}")
+        print(f"remaining: {self.black_deck_size}")
         print_puzzles(self.black_puzzles)
 
         print("WHITE PUZZLES:")
-        print(f"remaining: {len(self.white_puzzles_remaining)}")
+        print(f"remaining: {self.white_deck_size}")
         print_puzzles(self.white_puzzles)
@@ -0,0 +1,142 @@
+import json
+import typing
+
+from pydantic import validator
+
+from projectl import ActionData, CustomModel
+
+# Messages of the websocket protocol, all of them JSON objects with a "type".
+#
+# client -> server
+#   create         {"players": 2, "seat": 0, "bots": {"1": "greedy"}} creates
+#                  a game, joins it at seat (null to only watch) and gives
+#                  the bots seats to server agents
+#   join           {"game": id, "seat": 1} joins a game, null seat to watch
+#
+#   both take "format": "json" (default) or "binary", for binary clients
+#   the "state" of the server messages comes instead as the next websocket
+#   message, in the layout of GameStateWriter.binary
+#
+#   action         {"action": id} or {"action": {"action": 4, "action_data":
+#                  {...}}} plays for the seat of the client
+#   legal_actions  {"master_limit": 0} asks for the legal action ids
+#   resign         ends the game, the seat of the client loses
+#   resync         asks for a snapshot, after a gap in the update numbers
+#
+# server -> client
+#   joined         {"game", "seat", "seq", "state"} the full state once
+#   update         {"player", "action", "seq", ...} after every action, the
+#                  patch or keyframe of state_stream.py
+#   snapshot       {"seq", "state"} the answer to resync
+#   legal_actions  {"actions"}
+#   game_over      {"points", "resigned"}
+#   error          {"message"}
+
+MAX_MASTER_LIMIT = 10000
+STATE_FORMATS = ["json", "binary"]
+
+
+def correct_format(value: str) -> str:
+    if value not in STATE_FORMATS:
+        raise ValueError(f"{value} not in {STATE_FORMATS}")
+    return value
+
+
+class CreateMessage(CustomModel):
+    type: typing.Literal["create"]
+    players: int = 2
+    seat: typing.Optional[int] = 0
+    bots: typing.Dict[int, str] = {}
+    format: str = "json"
+
+    _correct_format = validator("format", allow_reuse=True)(correct_format)
+
+    @validator("players")
+    def correct_players_range(cls, value: int) -> int:
+        if value < 1 or value > 4:
+            raise ValueError(f"{value} must be between 1 and 4")
+        return value
+
+
+class JoinMessage(CustomModel):
+    type: typing.Literal["join"]
+    game: int
+    seat: typing.Optional[int] = None
+    format: str = "json"
+
+    _correct_format = validator("format", allow_reuse=True)(correct_format)
+
+
+class ActionMessage(CustomModel):
+    type: typing.Literal["action"]
+    action: typing.Union[int, typing.Dict[str, typing.Any]]
+
+    @validator("action")
+    def correct_action(
+        cls, value: typing.Union[int, typing.Dict[str, typing.Any]]
+    ) -> typing.Union[int, ActionData]:
+        if isinstance(value, int):
+            if value < 0:
+                raise ValueError(f"{value} is not a valid action id")
+            return value
+        if not isinstance(value.get("action"), int):
+            raise ValueError(f"{value} has no action number")
+        if not isinstance(value.get("action_data", {}), dict):
+            raise ValueError(f"{value} has action_data that is not an object")
+        return {"action": value["action"], "action_data": value.get("action_data", {})}
+
+
+class LegalActionsMessage(CustomModel):
+    type: typing.Literal["legal_actions"]
+    master_limit: int = 0
+
+    @validator("master_limit")
+    def correct_master_limit(cls, value: int) -> int:
+        if value < 0 or value > MAX_MASTER_LIMIT:
+            raise ValueError(f"{value} must be between 0 and {MAX_MASTER_LIMIT}")
+        return value
+
+
+class ResignMessage(CustomModel):
+    type: typing.Literal["resign"]
+
+
+class ResyncMessage(CustomModel):
+    type: typing.Literal["resync"]
+
+
+ClientMessage = typing.Union[
+    CreateMessage,
+    JoinMessage,
+    ActionMessage,
+    LegalActionsMessage,
+    ResignMessage,
+    ResyncMessage,
+]
+
+client_messages: typing.Dict[str, typing.Type[CustomModel]] = {
+    "create": CreateMessage,
+    "join": JoinMessage,
+    "action": ActionMessage,
+    "legal_actions": LegalActionsMessage,
+    "resign": ResignMessage,
+    "resync": ResyncMessage,
+}
+
+
+def parse_message(message: typing.Union[str, bytes]) -> ClientMessage:
+    data = json.loads(message)
+    if not isinstance(data, dict) or data.get("type") not in client_messages:
+        raise ValueError(f"Unknown message {message!r}")
+    return typing.cast(ClientMessage, client_messages[data["type"]].parse_obj(data))
+
+
+def server_message(
+    type: str, raw: typing.Optional[typing.Dict[str, str]] = None, **fields: typing.Any
+) -> str:
+    # the raw fields are already JSON text
+    message = json.dumps({"type": type, **fields})
+    if raw:
+        fields_json = "".join(f', "{key}": {value}' for key, value in raw.items())
+        message = f"{message[:-1]}{fields_json}}}"
+    return message
@@ -1,10 +1,12 @@
-from piece import Piece, piece_color
+from piece import Piece, piece_color, cell_index, BOARD_SIZE, BOARD_CELLS
 import typing
 from sty import bg
 
 Row = typing.List[int]
 Matrix = typing.List[Row]
 
+cell_shifts = [4 * i for i in range(BOARD_CELLS)]
+
 
 class PuzzleData(typing.TypedDict):
     matrix: Matrix
@@ -13,11 +15,48 @@ class PuzzleData(typing.TypedDict):
 
 
 class Puzzle:
+    __slots__ = ("free", "cells", "points", "reward")
+
     def __init__(self, matrix: Matrix, points: int, reward: Piece) -> None:
-        self.matrix = matrix
+        # `free` has bit x * 5 + y set while matrix[x][y] is empty and `cells`
+        # keeps the value of every position packed as 4-bit slots
+        self.free = 0
+        self.cells = 0
+        for x, row in enumerate(matrix):
+            for y, value in enumerate(row):
+                i = cell_index(x, y)
+                if value == 0:
+                    self.free |= 1 << i
+                self.cells |= value << (4 * i)
         self.points = points
         self.reward = reward
 
+    @property
+    def matrix(self) -> Matrix:
+        values = self.values()
+        return [values[x : x + BOARD_SIZE] for x in range(0, BOARD_CELLS, BOARD_SIZE)]
+
+    def values(self) -> Row:
+        return [self.cells >> shift & 0xF for shift in cell_shifts]
+
+    def free_coords(self) -> typing.List[typing.Tuple[int, int]]:
+        return [
+            (x, y)
+            for x in range(BOARD_SIZE)
+            for y in range(BOARD_SIZE)
+            if self.free >> cell_index(x, y) & 1
+        ]
+
+    def is_done(self) -> bool:
+        return self.free == 0
+
+    def fits(self, mask: int) -> bool:
+        return self.free & mask == mask
+
+    def place(self, mask: int, cells: int) -> None:
+        self.free &= ~mask
+        self.cells |= cells
+
     def extract_data(self) -> PuzzleData:
         return {
             "matrix": self.matrix,
@@ -26,18 +65,20 @@ class Puzzle:
         }
 
     def copy(self) -> "Puzzle":
-        return Puzzle(
-            [row.copy() for row in self.matrix],
-            int(self.points),
-            Piece(self.reward.value),
-        )
+        puzzle = Puzzle.__new__(Puzzle)
+        puzzle.free = self.free
+        puzzle.cells = self.cells
+        puzzle.points = self.points
+        puzzle.reward = self.reward
+        return puzzle
 
     def __repr__(self) -> str:
 
+        matrix = self.matrix
         matrix_repr = ["", "", "", "", ""]
         for j in range(5):
             for i in range(4, -1, -1):
-                matrix_repr[i] += piece_color[self.matrix[j][i]]
+                matrix_repr[i] += piece_color[matrix[j][i]]
 
         matrix_repr = [
             piece_color[1] * 7,
@@ -0,0 +1,396 @@
+import multiprocessing
+import multiprocessing.synchronize
+import random
+import time
+import typing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from action_space import (
+    ACTION_SPACE_SIZE,
+    decode_compact_action,
+    legal_action_mask,
+    policy_action_id,
+)
+from batch_env import BatchProjectLEnv
+from mcts import MCTSPlayer, RolloutPolicy, greedy_policy, random_policy
+from observation import encode_observation, observation_size
+from projectl import ProjectLGame
+
+# Self-play records go to a ring buffer in shared memory that the trainer
+# reads without copies. A record is (observation, action, legal mask,
+# outcome), the outcome is from the point of view of the player that acted
+# (1 won, 0 tied, -1 lost) and stays NaN until the game ends. Every slot
+# keeps the sequence number of its record, so a late outcome never lands on
+# a slot that was already reused.
+
+BatchPolicy = typing.Callable[[np.ndarray, np.ndarray, np.random.Generator], np.ndarray]
+
+HEADER_FIELDS = 2  # records written, games played
+WORKER_FIELDS = 4  # games, records, cpu seconds, wall seconds
+ALIGNMENT = 64
+
+
+class MCTSAgent:
+    def __init__(self, **settings: typing.Any) -> None:
+        # MCTSPlayer arguments, by default a small search per action
+        self.settings = {"iterations": 50, **settings}
+        self.player: typing.Optional[MCTSPlayer] = None
+
+    def __call__(self, game: ProjectLGame, rng: random.Random) -> int:
+        if self.player is None:
+            self.player = MCTSPlayer(**self.settings, seed=rng.getrandbits(32))
+        return self.player.choose(game)[0]
+
+
+def random_batch_policy(
+    observations: np.ndarray, legal_masks: np.ndarray, rng: np.random.Generator
+) -> np.ndarray:
+    return (rng.random(legal_masks.shape, dtype=np.float32) * legal_masks).argmax(1)
+
+
+agents: typing.Dict[str, RolloutPolicy] = {
+    "random": random_policy,
+    "greedy": greedy_policy,
+    "mcts": MCTSAgent(),
+}
+
+batch_agents: typing.Dict[str, BatchPolicy] = {"random": random_batch_policy}
+
+
+def outcomes_of(points: typing.Sequence[int]) -> typing.List[float]:
+    best = max(points)
+    winners = sum(p == best for p in points)
+    return [(1.0 if winners == 1 else 0.0) if p == best else -1.0 for p in points]
+
+
+# REPLAY BUFFER
+
+
+class BufferSpec(typing.NamedTuple):
+    name: str
+    capacity: int
+    observation_size: int
+    workers: int
+
+
+def buffer_fields(
+    spec: BufferSpec,
+) -> typing.List[typing.Tuple[str, typing.Tuple[int, ...], typing.Any]]:
+    return [
+        ("header", (HEADER_FIELDS,), np.int64),
+        ("worker_stats", (spec.workers, WORKER_FIELDS), np.float64),
+        ("sequences", (spec.capacity,), np.int64),
+        ("actions", (spec.capacity,), np.int64),
+        ("outcomes", (spec.capacity,), np.float32),
+        ("observations", (spec.capacity, spec.observation_size), np.float32),
+        ("legal_masks", (spec.capacity, ACTION_SPACE_SIZE), bool),
+    ]
+
+
+def buffer_layout(
+    spec: BufferSpec,
+) -> typing.Tuple[
+    typing.Dict[str, typing.Tuple[int, typing.Tuple[int, ...], typing.Any]], int
+]:
+    layout = {}
+    offset = 0
+    for name, shape, dtype in buffer_fields(spec):
+        layout[name] = (offset, shape, dtype)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        offset += -(-size // ALIGNMENT) * ALIGNMENT
+    return layout, offset
+
+
+class ReplayBuffer:
+    def __init__(
+        self,
+        spec: BufferSpec,
+        memory: typing.Optional[shared_memory.SharedMemory] = None,
+    ) -> None:
+        self.spec = spec
+        self.memory = memory or shared_memory.SharedMemory(spec.name)
+        layout, _ = buffer_layout(spec)
+        arrays = {
+            name: np.ndarray(shape, dtype, buffer=self.memory.buf, offset=offset)
+            for name, (offset, shape, dtype) in layout.items()
+        }
+        self.header: np.ndarray = arrays["header"]
+        self.worker_stats: np.ndarray = arrays["worker_stats"]
+        self.sequences: np.ndarray = arrays["sequences"]
+        self.actions: np.ndarray = arrays["actions"]
+        self.outcomes: np.ndarray = arrays["outcomes"]
+        self.observations: np.ndarray = arrays["observations"]
+        self.legal_masks: np.ndarray = arrays["legal_masks"]
+
+    @staticmethod
+    def create(capacity: int, observation_size: int, workers: int) -> "ReplayBuffer":
+        spec = BufferSpec("", capacity, observation_size, workers)
+        memory = shared_memory.SharedMemory(create=True, size=buffer_layout(spec)[1])
+        buffer = ReplayBuffer(spec._replace(name=memory.name), memory)
+        buffer.header[:] = 0
+        buffer.worker_stats[:] = 0
+        buffer.sequences[:] = -1
+        buffer.outcomes[:] = np.nan
+        return buffer
+
+    def write(
+        self,
+        observations: np.ndarray,
+        actions: np.ndarray,
+        legal_masks: np.ndarray,
+        lock: multiprocessing.synchronize.Lock,
+        outcomes: typing.Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        # returns the sequence numbers of the records, only the reservation of
+        # the slots needs the lock
+        count = len(actions)
+        with lock:
+            start = int(self.header[0])
+            self.header[0] += count
+        sequences = np.arange(start, start + count)
+        slots = sequences % self.spec.capacity
+        self.sequences[slots] = -1
+        self.observations[slots] = observations
+        self.actions[slots] = actions
+        self.legal_masks[slots] = legal_masks
+        self.outcomes[slots] = np.nan if outcomes is None else outcomes
+        self.sequences[slots] = sequences
+        return sequences
+
+    def set_outcomes(self, sequences: np.ndarray, outcomes: np.ndarray) -> None:
+        slots = sequences % self.spec.capacity
+        current = self.sequences[slots] == sequences
+        self.outcomes[slots[current]] = outcomes[current]
+
+    def add_game(self, lock: multiprocessing.synchronize.Lock) -> None:
+        with lock:
+            self.header[1] += 1
+
+    @property
+    def records(self) -> int:
+        return int(self.header[0])
+
+    @property
+    def games(self) -> int:
+        return int(self.header[1])
+
+    @property
+    def fill(self) -> float:
+        return min(self.records, self.spec.capacity) / self.spec.capacity
+
+    def ready(self) -> np.ndarray:
+        return ~np.isnan(self.outcomes) & (self.sequences >= 0)
+
+    def sample(
+        self, batch_size: int, rng: np.random.Generator
+    ) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        slots = rng.choice(np.flatnonzero(self.ready()), batch_size)
+        return (
+            self.observations[slots],
+            self.actions[slots],
+            self.legal_masks[slots],
+            self.outcomes[slots],
+        )
+
+    def close(self) -> None:
+        self.memory.close()
+
+    def unlink(self) -> None:
+        self.memory.unlink()
+
+
+# WORKERS
+
+
+def play_games(
+    buffer: ReplayBuffer,
+    lock: multiprocessing.synchronize.Lock,
+    stats: np.ndarray,
+    agent: RolloutPolicy,
+    player_quantity: int,
+    stop: multiprocessing.synchronize.Event,
+    seed: int,
+) -> None:
+    rng = random.Random(seed)
+    random.seed(seed)
+    size = observation_size(player_quantity)
+    while not stop.is_set():
+        game = ProjectLGame(player_quantity)
+        observations: typing.List[np.ndarray] = []
+        masks: typing.List[np.ndarray] = []
+        actions: typing.List[int] = []
+        players: typing.List[int] = []
+        while game.remaining_rounds != -1 and not stop.is_set():
+            observations.append(encode_observation(game, np.empty(size, np.float32)))
+            masks.append(legal_action_mask(game, master_slots=True))
+            players.append(game.current_player)
+            # MASTER actions are recorded as their MASTER slot
+            action_id = agent(game, rng)
+            actions.append(policy_action_id(game, action_id))
+            game.step_fast(decode_compact_action(action_id))
+        if game.remaining_rounds != -1:
+            break
+
+        outcomes = outcomes_of(game.players_points)
+        buffer.write(
+            np.stack(observations),
+            np.array(actions),
+            np.stack(masks),
+            lock,
+            np.array([outcomes[player] for player in players], np.float32),
+        )
+        buffer.add_game(lock)
+        stats[0] += 1
+        stats[1] += len(actions)
+
+
+def play_batch_games(
+    buffer: ReplayBuffer,
+    lock: multiprocessing.synchronize.Lock,
+    stats: np.ndarray,
+    agent: BatchPolicy,
+    player_quantity: int,
+    num_envs: int,
+    stop: multiprocessing.synchronize.Event,
+    seed: int,
+) -> None:
+    rng = np.random.default_rng(seed)
+    env = BatchProjectLEnv(num_envs, player_quantity, seed)
+    # sequence numbers and players of the records of the running games
+    sequences: typing.List[typing.List[int]] = [[] for _ in range(num_envs)]
+    players: typing.List[typing.List[int]] = [[] for _ in range(num_envs)]
+    while not stop.is_set():
+        actions = agent(env.observations, env.legal_masks, rng)
+        written = buffer.write(env.observations, actions, env.legal_masks, lock)
+        for i, (sequence, player) in enumerate(
+            zip(written.tolist(), env.current_player.tolist())
+        ):
+            sequences[i].append(sequence)
+            players[i].append(player)
+
+        _, _, dones, _ = env.step(actions)
+        for i in np.flatnonzero(dones).tolist():
+            outcomes = outcomes_of(env.final_points[i].tolist())
+            buffer.set_outcomes(
+                np.array(sequences[i]),
+                np.array([outcomes[player] for player in players[i]], np.float32),
+            )
+            buffer.add_game(lock)
+            stats[0] += 1
+            stats[1] += len(sequences[i])
+            sequences[i] = []
+            players[i] = []
+
+
+def run_worker(
+    spec: BufferSpec,
+    lock: multiprocessing.synchronize.Lock,
+    stop: multiprocessing.synchronize.Event,
+    worker: int,
+    agent: typing.Union[str, RolloutPolicy, BatchPolicy],
+    player_quantity: int,
+    num_envs: int,
+    seed: int,
+) -> None:
+    # num_envs > 0 plays on a BatchProjectLEnv with a batch policy
+    buffer = ReplayBuffer(spec)
+    stats = buffer.worker_stats[worker]
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        if num_envs > 0:
+            batch_agent = batch_agents[agent] if isinstance(agent, str) else agent
+            play_batch_games(
+                buffer,
+                lock,
+                stats,
+                typing.cast(BatchPolicy, batch_agent),
+                player_quantity,
+                num_envs,
+                stop,
+                seed,
+            )
+        else:
+            game_agent = agents[agent] if isinstance(agent, str) else agent
+            play_games(
+                buffer,
+                lock,
+                stats,
+                typing.cast(RolloutPolicy, game_agent),
+                player_quantity,
+                stop,
+                seed,
+            )
+    finally:
+        stats[2] = time.process_time() - cpu
+        stats[3] = time.perf_counter() - wall
+        buffer.close()
+
+
+def self_play(
+    workers: int,
+    duration: float,
+    agent: typing.Union[str, RolloutPolicy, BatchPolicy] = "random",
+    num_envs: int = 0,
+    player_quantity: int = 2,
+    capacity: int = 1 << 16,
+    report_every: float = 1.0,
+    seed: int = 0,
+) -> ReplayBuffer:
+    # plays for duration seconds and returns the buffer, the caller has to
+    # close and unlink it
+    buffer = ReplayBuffer.create(capacity, observation_size(player_quantity), workers)
+    lock = multiprocessing.Lock()
+    stop = multiprocessing.Event()
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(
+                buffer.spec,
+                lock,
+                stop,
+                worker,
+                agent,
+                player_quantity,
+                num_envs,
+                seed + worker,
+            ),
+        )
+        for worker in range(workers)
+    ]
+    begin = time.perf_counter()
+    for process in processes:
+        process.start()
+
+    last_report, last_games = begin, 0
+    while time.perf_counter() - begin < duration:
+        time.sleep(min(report_every, duration - (time.perf_counter() - begin)))
+        now = time.perf_counter()
+        games = buffer.games
+        print(
+            f"{now - begin:6.1f} s | {games:6} games | "
+            f"{(games - last_games) / (now - last_report):7.1f} games/s | "
+            f"{buffer.records:9} records | fill {buffer.fill:6.1%}"
+        )
+        last_report, last_games = now, games
+
+    stop.set()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - begin
+    for worker, (games, records, cpu, wall) in enumerate(buffer.worker_stats):
+        print(
+            f"worker {worker}: {int(games)} games, {int(records)} records, "
+            f"utilisation {cpu / wall if wall > 0 else 0:.1%}"
+        )
+    print(f"{buffer.games / elapsed:.1f} games/s, fill {buffer.fill:.1%}")
+    return buffer
+
+
+if __name__ == "__main__":
+    for agent, num_envs in [("random", 0), ("random", 256)]:
+        print(f"{agent} agent, {num_envs or 'no'} batch envs")
+        buffer = self_play(multiprocessing.cpu_count(), 10.0, agent, num_envs)
+        buffer.close()
+        buffer.unlink()
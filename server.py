@@ -1,27 +1,331 @@
 import asyncio
-from websockets import server
-from compute_actions import compute
+import collections
+import concurrent.futures
+import itertools
+import os
 import random
-from game_adapter import json_of_game_state
+import sys
+import time
+import typing
+
+from websockets import server
+
+from action_space import decode_compact_action, legal_actions
+from codec import decode_game, encode_game
+from game_adapter import GameStateWriter
+from projectl import ActionData, ProjectLGame
+from protocol import (
+    ActionMessage,
+    ClientMessage,
+    CreateMessage,
+    JoinMessage,
+    LegalActionsMessage,
+    ResignMessage,
+    ResyncMessage,
+    parse_message,
+    server_message,
+)
+from selfplay import agents
+from state_stream import StateStream
+
+# Clients create or join games (see protocol.py), as players of a seat or to
+# watch. Each game runs in its own task that takes the messages of its
+# clients from a queue one at a time and plays the seats given to server
+# agents. The agents and the legal actions run in a pool (processes by
+# default, `python3 server.py thread` for threads) so the event loop only
+# moves messages, the games travel to the pool as codec bytes. A game task is
+# cancelled as soon as its last client goes away.
+
+LATENCY_WINDOW = 4096
+REPORT_EVERY = 10.0
+
+Message = typing.Union[str, bytes]
+
+
+def choose_action(data: bytes, agent: str, seed: int) -> int:
+    return agents[agent](decode_game(data), random.Random(seed))
+
+
+def list_legal_actions(data: bytes, master_limit: int) -> typing.List[int]:
+    return legal_actions(decode_game(data), master_limit)
+
+
+class TurnLatency:
+    def __init__(self, window: int = LATENCY_WINDOW) -> None:
+        self.samples: typing.Deque[float] = collections.deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        if len(self.samples) == 0:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class Client:
+    def __init__(self, websocket: server.WebSocketServerProtocol) -> None:
+        self.websocket = websocket
+        self.messages: "asyncio.Queue[Message]" = asyncio.Queue()
+        self.room: typing.Optional["Room"] = None
+        self.seat: typing.Optional[int] = None
+        self.format = "json"
+
+    def send(self, type: str, **fields: typing.Any) -> None:
+        self.messages.put_nowait(server_message(type, **fields))
+
+    def send_all(self, messages: typing.List[Message]) -> None:
+        for message in messages:
+            self.messages.put_nowait(message)
+
+
+class Room:
+    def __init__(self, room_id: int, players: int, bots: typing.Dict[int, str]) -> None:
+        self.id = room_id
+        self.game = ProjectLGame(players)
+        self.bots = bots
+        self.seats: typing.Dict[int, Client] = {}
+        self.clients: typing.Set[Client] = set()
+        self.inbox: "asyncio.Queue[typing.Tuple[Client, ClientMessage]]" = (
+            asyncio.Queue()
+        )
+        self.stream = StateStream(self.game)
+        self.writer = GameStateWriter()
+        self.over = False
+        self.rng = random.Random()
+        self.task: typing.Optional[asyncio.Task] = None
+
+    def broadcast(self, type: str, **fields: typing.Any) -> None:
+        message = server_message(type, **fields)
+        for client in self.clients:
+            client.messages.put_nowait(message)
 
-from projectl import ProjectLGame
+    def state_messages(
+        self, format: str, type: str, **fields: typing.Any
+    ) -> typing.List[Message]:
+        if format == "binary":
+            return [server_message(type, **fields), self.writer.binary(self.game)]
+        return [server_message(type, {"state": self.writer.json(self.game)}, **fields)]
 
+    def broadcast_state(self, type: str, **fields: typing.Any) -> None:
+        # each format is written once whatever the number of clients
+        messages: typing.Dict[str, typing.List[Message]] = {}
+        for client in self.clients:
+            if client.format not in messages:
+                messages[client.format] = self.state_messages(
+                    client.format, type, **fields
+                )
+            client.send_all(messages[client.format])
 
-async def handler(websocket: server.WebSocketServerProtocol):
-    game = ProjectLGame(2)
-    while True:
-        await websocket.send(json_of_game_state(game.extract_state()))
-        possible_actions = compute(game)
-        if len(possible_actions) == 0:
+    def publish(self, player: int, action: typing.Union[int, ActionData, None]) -> None:
+        update = self.stream.update()
+        if update.get("keyframe"):
+            self.broadcast_state("update", player=player, action=action, **update)
+        else:
+            self.broadcast("update", player=player, action=action, **update)
+        if self.game.remaining_rounds == -1:
+            self.finish(None)
+
+    def finish(self, resigned: typing.Optional[int]) -> None:
+        self.over = True
+        self.broadcast(
+            "game_over", points=list(self.game.players_points), resigned=resigned
+        )
+
+    def bot_turn(self) -> typing.Optional[str]:
+        if self.over:
+            return None
+        return self.bots.get(self.game.current_player)
+
+
+class GameServer:
+    def __init__(self, executor: concurrent.futures.Executor) -> None:
+        self.executor = executor
+        self.latency = TurnLatency()
+        self.rooms: typing.Dict[int, Room] = {}
+        self.room_ids = itertools.count()
+
+    async def handler(self, websocket: server.WebSocketServerProtocol) -> None:
+        client = Client(websocket)
+        sender = asyncio.create_task(self.send_messages(client))
+        try:
+            async for message in websocket:
+                try:
+                    self.receive(client, parse_message(message))
+                except ValueError as e:
+                    client.send("error", message=str(e))
+        finally:
+            sender.cancel()
+            self.leave(client)
+
+    async def send_messages(self, client: Client) -> None:
+        while True:
+            await client.websocket.send(await client.messages.get())
+
+    def receive(self, client: Client, message: ClientMessage) -> None:
+        if isinstance(message, (CreateMessage, JoinMessage)):
+            if client.room is not None:
+                raise ValueError(f"Already in game {client.room.id}")
+            if isinstance(message, CreateMessage):
+                room = self.create_room(message)
+            elif message.game in self.rooms:
+                room = self.rooms[message.game]
+            else:
+                raise ValueError(f"Unknown game {message.game}")
+            self.join_room(client, room, message.seat, message.format)
+        elif client.room is None:
+            raise ValueError("Create or join a game first")
+        else:
+            client.room.inbox.put_nowait((client, message))
+
+    def create_room(self, message: CreateMessage) -> Room:
+        for seat, agent in message.bots.items():
+            if seat < 0 or seat >= message.players:
+                raise ValueError(
+                    f"Seat {seat} must be between 0 and {message.players - 1}"
+                )
+            if agent not in agents:
+                raise ValueError(f"Unknown agent {agent}, use one of {list(agents)}")
+        if message.seat is not None:
+            if message.seat < 0 or message.seat >= message.players:
+                raise ValueError(
+                    f"Seat {message.seat} must be between 0 and {message.players - 1}"
+                )
+            if message.seat in message.bots:
+                raise ValueError(f"Seat {message.seat} is played by a bot")
+        room = Room(next(self.room_ids), message.players, message.bots)
+        room.task = asyncio.create_task(self.run_room(room))
+        self.rooms[room.id] = room
+        return room
+
+    def join_room(
+        self, client: Client, room: Room, seat: typing.Optional[int], format: str
+    ) -> None:
+        if seat is not None:
+            if seat < 0 or seat >= room.game.player_quantity:
+                raise ValueError(
+                    f"Seat {seat} must be between 0 and {room.game.player_quantity - 1}"
+                )
+            if seat in room.seats or seat in room.bots:
+                raise ValueError(f"Seat {seat} is taken")
+            room.seats[seat] = client
+        room.clients.add(client)
+        client.room, client.seat, client.format = room, seat, format
+        client.send_all(
+            room.state_messages(
+                format, "joined", game=room.id, seat=seat, seq=room.stream.seq
+            )
+        )
+
+    def leave(self, client: Client) -> None:
+        room = client.room
+        if room is None:
+            return
+        room.clients.discard(client)
+        if client.seat is not None:
+            room.seats.pop(client.seat, None)
+        client.room, client.seat, client.format = None, None, "json"
+        if len(room.clients) == 0:
+            # a move already running in the pool finishes there but its result
+            # is dropped, the ones still waiting in the pool are cancelled
+            if room.task is not None:
+                room.task.cancel()
+            del self.rooms[room.id]
+
+    async def run_room(self, room: Room) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            agent = room.bot_turn()
+            if agent is not None:
+                begin = time.perf_counter()
+                action_id = await loop.run_in_executor(
+                    self.executor,
+                    choose_action,
+                    encode_game(room.game),
+                    agent,
+                    room.rng.getrandbits(32),
+                )
+                self.latency.add(time.perf_counter() - begin)
+                player = room.game.current_player
+                room.game.step_fast(decode_compact_action(action_id))
+                room.publish(player, action_id)
+                continue
+
+            client, message = await room.inbox.get()
+            try:
+                await self.handle(room, client, message)
+            except (ProjectLGame.InvalidAction, ValueError) as e:
+                client.send("error", message=str(e))
+
+    async def handle(self, room: Room, client: Client, message: ClientMessage) -> None:
+        if isinstance(message, LegalActionsMessage):
+            action_ids: typing.List[int] = []
+            if not room.over and client.seat == room.game.current_player:
+                action_ids = await asyncio.get_running_loop().run_in_executor(
+                    self.executor,
+                    list_legal_actions,
+                    encode_game(room.game),
+                    message.master_limit,
+                )
+            client.send("legal_actions", actions=action_ids)
             return
-        (random_action, _) = random.choice(possible_actions)
-        game.step(random_action)
+
+        if isinstance(message, ResyncMessage):
+            client.send_all(
+                room.state_messages(client.format, "snapshot", seq=room.stream.seq)
+            )
+            return
+
+        if room.over:
+            raise ValueError("The game is over")
+        if client.seat is None:
+            raise ValueError("Spectators cannot play")
+
+        if isinstance(message, ResignMessage):
+            room.finish(client.seat)
+
+        elif isinstance(message, ActionMessage):
+            if client.seat != room.game.current_player:
+                raise ValueError(f"It is the turn of seat {room.game.current_player}")
+            # correct_action gives an action id or an ActionData
+            action = typing.cast(typing.Union[int, ActionData], message.action)
+            begin = time.perf_counter()
+            if isinstance(action, int):
+                room.game.step_fast(decode_compact_action(action))
+            else:
+                room.game.play(action)
+            room.publish(client.seat, action)
+            self.latency.add(time.perf_counter() - begin)
+
+    async def report(self) -> None:
+        while True:
+            await asyncio.sleep(REPORT_EVERY)
+            print(
+                f"{len(self.rooms)} games, turn latency "
+                f"p50 {self.latency.percentile(50) * 1000:.1f} ms "
+                f"p99 {self.latency.percentile(99) * 1000:.1f} ms"
+            )
+
+
+def make_executor(kind: str) -> concurrent.futures.Executor:
+    workers = os.cpu_count() or 1
+    if kind == "thread":
+        return concurrent.futures.ThreadPoolExecutor(workers)
+    if kind == "process":
+        return concurrent.futures.ProcessPoolExecutor(workers)
+    raise ValueError(f"Unknown executor {kind}")
 
 
-async def main():
-    async with server.serve(handler, "localhost", 8765):
-        print("started server on ws://localhost:8765")
-        await asyncio.Future()  # run forever
+async def main(kind: str = "process"):
+    with make_executor(kind) as executor:
+        game_server = GameServer(executor)
+        reporter = asyncio.create_task(game_server.report())
+        async with server.serve(game_server.handler, "localhost", 8765):
+            print("started server on ws://localhost:8765")
+            await asyncio.Future()  # run forever
+        reporter.cancel()
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    asyncio.run(main(*sys.argv[1:]))
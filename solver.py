@@ -0,0 +1,70 @@
+import functools
+import typing
+
+from piece import BOARD_CELLS, PIECE_TYPES, Piece, piece_index, piece_size, placements
+from projectl import ProjectLGame
+
+# Can the free cells of a puzzle be covered with the pieces of an inventory?
+# The search always covers the lowest free cell, so only the placements whose
+# lowest cell is that one have to be tried, and every (mask, inventory) it
+# goes through is memoised: the same puzzles come back all the time.
+
+Inventory = typing.Tuple[int, ...]
+
+sizes = [piece_size[piece] for piece in Piece]
+
+# placements by their lowest cell, as (mask, piece index) pairs
+placements_by_low_cell: typing.List[typing.List[typing.Tuple[int, int]]] = [
+    [
+        (p.mask, piece_index[p.piece])
+        for p in placements
+        if p.mask & -p.mask == 1 << cell
+    ]
+    for cell in range(BOARD_CELLS)
+]
+
+
+def inventory_of(game: ProjectLGame, player: int) -> Inventory:
+    start = player * PIECE_TYPES
+    return tuple(game.inventories[start : start + PIECE_TYPES])
+
+
+def can_complete(
+    puzzle_mask: int, inventory: typing.Sequence[int]
+) -> typing.Tuple[bool, int]:
+    # puzzle_mask is the free mask of the puzzle and inventory has a quantity
+    # per piece index; min_pieces is 0 when the puzzle can't be completed
+    pieces = min_pieces(puzzle_mask, useful_pieces(puzzle_mask, inventory))
+    return pieces is not None, pieces or 0
+
+
+def useful_pieces(puzzle_mask: int, inventory: typing.Sequence[int]) -> Inventory:
+    # more pieces of a type than the free cells can hold change nothing, capping
+    # them lets more inventories share the same memo entries
+    cells = bin(puzzle_mask).count("1")
+    return tuple(min(q, cells // size) for q, size in zip(inventory, sizes))
+
+
+@functools.lru_cache(maxsize=1 << 18)
+def min_pieces(puzzle_mask: int, inventory: Inventory) -> typing.Optional[int]:
+    if puzzle_mask == 0:
+        return 0
+    if sum(q * size for q, size in zip(inventory, sizes)) < bin(puzzle_mask).count("1"):
+        return None
+
+    best: typing.Optional[int] = None
+    low_cell = (puzzle_mask & -puzzle_mask).bit_length() - 1
+    for mask, piece in placements_by_low_cell[low_cell]:
+        if inventory[piece] == 0 or puzzle_mask & mask != mask:
+            continue
+        rest_mask = puzzle_mask & ~mask
+        rest = min_pieces(
+            rest_mask,
+            useful_pieces(
+                rest_mask,
+                inventory[:piece] + (inventory[piece] - 1,) + inventory[piece + 1 :],
+            ),
+        )
+        if rest is not None and (best is None or rest + 1 < best):
+            best = rest + 1
+    return best
@@ -0,0 +1,228 @@
+import json
+import random
+import time
+import typing
+
+from action_space import decode_compact_action
+from game_adapter import GameStateWriter, json_of_game_state
+from mcts import greedy_policy
+from piece import BOARD_CELLS, BOARD_SIZE, PIECE_TYPES, Piece
+from projectl import ProjectLGame
+from puzzle import Puzzle
+
+# Instead of the whole state after every action, clients get the state once
+# and then patches with only what the action changed, every one with the
+# next sequence number:
+#
+#   cells        [[player, slot, cell, value], ...] cells of the players'
+#                puzzles that changed, cell is x * 5 + y
+#   removed      [[player, slot], ...] finished puzzles, removed in this order
+#   added        [[player, puzzle], ...] puzzles taken, appended to the player
+#   puzzles      {player: [puzzle, ...]} every puzzle of a player, only when
+#                the changes are not a removal plus some puzzles taken
+#   table        [[slot, puzzle or null], ...] slots 0 .. 3 black, 4 .. 7 white
+#   inventories  [[player, piece, delta], ...]
+#   points       [[player, points], ...]
+#   counters     {name: value} the other fields of the state that changed
+#
+# Every KEYFRAME_EVERY updates the patch is replaced by "keyframe": true and
+# the sender adds the whole state as "state" (in JSON or in binary, see
+# GameStateWriter), so a client that missed an update (a gap in the sequence
+# numbers) can also catch up without asking for a snapshot.
+
+KEYFRAME_EVERY = 64
+COUNTERS = [
+    "current_player",
+    "remaining_actions",
+    "did_master_action",
+    "remaining_rounds",
+    "points_to_pay",
+    "black_puzzles_remaining",
+    "white_puzzles_remaining",
+]
+
+pieces = list(Piece)
+
+
+class StreamState(typing.NamedTuple):
+    table: typing.Tuple[typing.Optional[Puzzle], ...]
+    puzzles: typing.Tuple[typing.Tuple[Puzzle, ...], ...]
+    cells: typing.Tuple[typing.Tuple[int, ...], ...]
+    inventories: typing.Tuple[int, ...]
+    points: typing.Tuple[int, ...]
+    counters: typing.Tuple[typing.Any, ...]
+
+
+def stream_state(game: ProjectLGame) -> StreamState:
+    return StreamState(
+        (*game.black_puzzles, *game.white_puzzles),
+        tuple(tuple(puzzles) for puzzles in game.players_puzzles),
+        tuple(tuple(p.cells for p in puzzles) for puzzles in game.players_puzzles),
+        tuple(game.inventories),
+        tuple(game.players_points),
+        (
+            game.current_player,
+            game.remaining_actions,
+            game.did_master_action,
+            game.remaining_rounds,
+            game.points_to_pay,
+            game.black_deck_size,
+            game.white_deck_size,
+        ),
+    )
+
+
+def state_patch(old: StreamState, new: StreamState) -> typing.Dict[str, typing.Any]:
+    patch: typing.Dict[str, typing.Any] = {}
+    cells: typing.List[typing.List[int]] = []
+    removed: typing.List[typing.List[int]] = []
+    added: typing.List[typing.List[typing.Any]] = []
+    replaced: typing.Dict[int, typing.Any] = {}
+    for player, (old_puzzles, new_puzzles) in enumerate(zip(old.puzzles, new.puzzles)):
+        if old_puzzles == new_puzzles and old.cells[player] == new.cells[player]:
+            continue
+        new_ids = {id(puzzle) for puzzle in new_puzzles}
+        kept = [i for i, puzzle in enumerate(old_puzzles) if id(puzzle) in new_ids]
+        if [old_puzzles[i] for i in kept] != list(new_puzzles[: len(kept)]):
+            replaced[player] = [puzzle.extract_data() for puzzle in new_puzzles]
+            continue
+        for slot, i in enumerate(kept):
+            changed = old.cells[player][i] ^ new.cells[player][slot]
+            for cell in range(BOARD_CELLS):
+                if changed >> 4 * cell & 0xF:
+                    value = new.cells[player][slot] >> 4 * cell & 0xF
+                    cells.append([player, i, cell, value])
+        removed.extend(
+            [player, i] for i in reversed(range(len(old_puzzles))) if i not in kept
+        )
+        added.extend(
+            [player, puzzle.extract_data()] for puzzle in new_puzzles[len(kept) :]
+        )
+
+    table = [
+        [slot, puzzle.extract_data() if puzzle is not None else None]
+        for slot, (old_puzzle, puzzle) in enumerate(zip(old.table, new.table))
+        if old_puzzle is not puzzle
+    ]
+    inventories = [
+        [slot // PIECE_TYPES, pieces[slot % PIECE_TYPES].value, count - old_count]
+        for slot, (old_count, count) in enumerate(zip(old.inventories, new.inventories))
+        if count != old_count
+    ]
+    points = [
+        [player, value]
+        for player, (old_value, value) in enumerate(zip(old.points, new.points))
+        if value != old_value
+    ]
+    counters = {
+        name: value
+        for name, old_value, value in zip(COUNTERS, old.counters, new.counters)
+        if value != old_value
+    }
+    if cells:
+        patch["cells"] = cells
+    if removed:
+        patch["removed"] = removed
+    if added:
+        patch["added"] = added
+    if replaced:
+        patch["puzzles"] = replaced
+    if table:
+        patch["table"] = table
+    if inventories:
+        patch["inventories"] = inventories
+    if points:
+        patch["points"] = points
+    if counters:
+        patch["counters"] = counters
+    return patch
+
+
+class StateStream:
+    def __init__(
+        self, game: ProjectLGame, keyframe_every: int = KEYFRAME_EVERY
+    ) -> None:
+        self.game = game
+        self.keyframe_every = keyframe_every
+        self.seq = 0
+        self.last = stream_state(game)
+
+    def update(self) -> typing.Dict[str, typing.Any]:
+        # the message for the last change of the game, without the state of
+        # the keyframes
+        self.seq += 1
+        state = stream_state(self.game)
+        if self.seq % self.keyframe_every == 0:
+            update = {"seq": self.seq, "keyframe": True}
+        else:
+            update = {"seq": self.seq, **state_patch(self.last, state)}
+        self.last = state
+        return update
+
+
+def apply_update(
+    state: typing.Dict[str, typing.Any], update: typing.Dict[str, typing.Any]
+) -> typing.Dict[str, typing.Any]:
+    # the client side, on a state as it is decoded from JSON (with str keys)
+    if update.get("keyframe"):
+        return update["state"]
+    players_puzzles = state["players_puzzles"]
+    for player, slot, cell, value in update.get("cells", []):
+        x, y = divmod(cell, BOARD_SIZE)
+        players_puzzles[str(player)][slot]["matrix"][x][y] = value
+    for player, slot in update.get("removed", []):
+        del players_puzzles[str(player)][slot]
+    for player, puzzle in update.get("added", []):
+        players_puzzles[str(player)].append(puzzle)
+    for player, puzzles in update.get("puzzles", {}).items():
+        players_puzzles[str(player)] = puzzles
+    for slot, puzzle in update.get("table", []):
+        if slot < 4:
+            state["black_puzzles"][slot] = puzzle
+        else:
+            state["white_puzzles"][slot - 4] = puzzle
+    for player, piece, delta in update.get("inventories", []):
+        state["players_pieces"][str(player)][str(piece)] += delta
+    for player, points in update.get("points", []):
+        state["players_points"][str(player)] = points
+    state.update(update.get("counters", {}))
+    return state
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    writer = GameStateWriter()
+    full_bytes = patch_bytes = steps = 0
+    full_time = patch_time = 0.0
+    for seed in range(5):
+        random.seed(seed)
+        game = ProjectLGame(2)
+        stream = StateStream(game)
+        client = json.loads(writer.json(game))
+        while game.remaining_rounds != -1:
+            game.step_fast(decode_compact_action(greedy_policy(game, rng)))
+            steps += 1
+
+            begin = time.perf_counter()
+            full = json_of_game_state(game.extract_state())
+            full_time += time.perf_counter() - begin
+
+            begin = time.perf_counter()
+            update = stream.update()
+            patch = json.dumps(update)
+            if update.get("keyframe"):
+                patch = f'{patch[:-1]}, "state": {writer.json(game)}}}'
+            patch_time += time.perf_counter() - begin
+
+            full_bytes += len(full)
+            patch_bytes += len(patch)
+            client = apply_update(client, json.loads(patch))
+            assert client == json.loads(full)
+
+    print(f"{steps} updates, all patches checked against the full state")
+    print(
+        f"full state {full_bytes / steps:7.1f} bytes {full_time / steps * 1e6:6.1f} us"
+    )
+    print(
+        f"patch      {patch_bytes / steps:7.1f} bytes {patch_time / steps * 1e6:6.1f} us"
+    )
@@ -0,0 +1,25 @@
+import random
+
+from action_space import (
+    decode_action,
+    decode_compact_action,
+    encode_action,
+    legal_actions,
+)
+from projectl import ProjectLGame, compact_action
+
+
+def test_action_ids_bijection() -> None:
+    for seed in range(4):
+        random.seed(seed)
+        game = ProjectLGame(2)
+        while game.remaining_rounds != -1:
+            action_ids = legal_actions(game, master_limit=64)
+            actions = [decode_compact_action(action_id) for action_id in action_ids]
+            # decoding is injective as encoding gives back every id
+            assert len(set(action_ids)) == len(action_ids)
+            for action_id, action in zip(action_ids, actions):
+                assert encode_action(action) == action_id
+                assert encode_action(decode_action(action_id)) == action_id
+                assert compact_action(decode_action(action_id)) == action
+            game.step_fast(random.choice(actions))
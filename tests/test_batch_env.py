@@ -0,0 +1,31 @@
+import numpy as np
+
+from action_space import MASTER_SLOT_OFFSET, game_action, master_slot_actions
+from batch_env import BatchProjectLEnv
+from observation import encode_observation
+
+
+def test_master_slots() -> None:
+    env = BatchProjectLEnv(16, seed=0, master_slots=True)
+    rng = np.random.default_rng(0)
+    masters = 0
+    for _ in range(300):
+        masks = env.legal_masks
+        # MASTER slots first when there are some, random actions otherwise
+        slots = masks[:, MASTER_SLOT_OFFSET:]
+        actions = np.where(
+            slots.any(1),
+            MASTER_SLOT_OFFSET + (rng.random(slots.shape) * slots).argmax(1),
+            (rng.random(masks.shape) * masks).argmax(1),
+        )
+        games = [env.to_game(i) for i in range(env.num_envs)]
+        for i, game in enumerate(games):
+            assert slots[i].sum() == len(master_slot_actions(game))
+        _, _, dones, _ = env.step(actions)
+        for i, game in enumerate(games):
+            masters += int(actions[i] >= MASTER_SLOT_OFFSET)
+            game.step_fast(game_action(game, int(actions[i])))
+            if not dones[i]:
+                assert env.to_game(i).extract_state() == game.extract_state()
+                assert np.array_equal(env.observations[i], encode_observation(game))
+    assert masters > 0
@@ -0,0 +1,113 @@
+import io
+import random
+import typing
+
+import pytest
+
+from action_space import (
+    GET_DOT_ID,
+    PLACE_PIECE_OFFSET,
+    STOP_ID,
+    decode_compact_action,
+    legal_actions,
+)
+from codec import (
+    LOG_HEADER,
+    RECORD_SIZE,
+    decode_game,
+    encode_game,
+    read_game_log,
+    write_game_log,
+)
+from game_adapter import GameStateWriter
+from projectl import ProjectLGame
+
+
+def random_games(seeds: int, steps: int) -> typing.Iterator[ProjectLGame]:
+    for seed in range(seeds):
+        random.seed(seed)
+        game = ProjectLGame(2 + seed % 3)
+        for _ in range(steps):
+            if game.remaining_rounds == -1:
+                break
+            yield game.copy()
+            action_id = random.choice(legal_actions(game))
+            game.step_fast(decode_compact_action(action_id))
+
+
+def negative_points_game() -> ProjectLGame:
+    # a piece placed in the last round and then STOP costs a point
+    game = ProjectLGame(2)
+    game.step_fast(decode_compact_action(4))
+    game.step_fast(decode_compact_action(GET_DOT_ID))
+    game.remaining_rounds = 0
+    place_id = next(
+        action_id
+        for action_id in legal_actions(game)
+        if PLACE_PIECE_OFFSET <= action_id < STOP_ID
+    )
+    game.step_fast(decode_compact_action(place_id))
+    game.step_fast(decode_compact_action(STOP_ID))
+    return game
+
+
+def assert_same_game(a: ProjectLGame, b: ProjectLGame) -> None:
+    assert a.extract_state() == b.extract_state()
+    assert a.black_deck[: a.black_deck_size] == b.black_deck[: b.black_deck_size]
+    assert a.white_deck[: a.white_deck_size] == b.white_deck[: b.white_deck_size]
+    assert a.hash() == b.hash()
+
+
+def test_negative_points_round_trip() -> None:
+    game = negative_points_game()
+    assert game.players_points[0] < 0
+    assert_same_game(decode_game(encode_game(game)), game)
+    assert_same_game(ProjectLGame.from_bytes(game.to_bytes()), game)
+    assert (
+        GameStateWriter().binary(game)
+        == encode_game(game)[: -game.black_deck_size - game.white_deck_size or None]
+    )
+
+
+def test_round_trip() -> None:
+    for game in random_games(6, 300):
+        data = encode_game(game)
+        assert_same_game(decode_game(data), game)
+        assert encode_game(decode_game(data)) == data
+
+
+def test_game_log() -> None:
+    games = [*random_games(2, 50), negative_points_game()]
+    log = io.BytesIO()
+    assert write_game_log(log, games) == len(games)
+    log.seek(0)
+    read = list(read_game_log(log))
+    assert len(read) == len(games)
+    for a, b in zip(read, games):
+        assert_same_game(a, b)
+
+
+def test_game_log_version() -> None:
+    log = io.BytesIO()
+    write_game_log(log, [])
+    data = bytearray(log.getvalue())
+    data[4] += 1
+    with pytest.raises(ValueError):
+        list(read_game_log(io.BytesIO(bytes(data))))
+
+
+def test_truncated_game_log() -> None:
+    log = io.BytesIO()
+    write_game_log(log, list(random_games(1, 3)))
+    data = log.getvalue()
+    ends = {LOG_HEADER.size}
+    for _ in range(3):
+        (length,) = RECORD_SIZE.unpack_from(data, max(ends))
+        ends.add(max(ends) + RECORD_SIZE.size + length)
+    assert max(ends) == len(data)
+    for end in range(len(data)):
+        if end in ends:
+            list(read_game_log(io.BytesIO(data[:end])))
+        else:
+            with pytest.raises(ValueError):
+                list(read_game_log(io.BytesIO(data[:end])))
@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+import completions
+import solver
+from puzzle import black_puzzles, white_puzzles
+
+
+def test_missing_table(monkeypatch: pytest.MonkeyPatch, tmp_path: str) -> None:
+    assert completions.load_completions(os.path.join(tmp_path, "missing")) is None
+    monkeypatch.setattr(completions, "load_completions", lambda: None)
+    for puzzle in [*black_puzzles, *white_puzzles]:
+        for inventory in [(1,) * 9, (3,) * 9]:
+            assert completions.can_complete(
+                puzzle.free, inventory
+            ) == solver.can_complete(puzzle.free, inventory)
+    with pytest.raises(FileNotFoundError):
+        completions.completions_of(black_puzzles[0].free)
@@ -0,0 +1,9 @@
+import pytest
+
+from parallel_mcts import ParallelMCTSPlayer
+
+
+def test_tree_mode_needs_virtual_loss() -> None:
+    with pytest.raises(ValueError):
+        ParallelMCTSPlayer(workers=8, mode="tree", iterations=100, virtual_loss=0)
+    ParallelMCTSPlayer(workers=8, mode="root", iterations=100, virtual_loss=0)
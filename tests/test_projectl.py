@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+from action_space import (
+    MASTER_OFFSET,
+    decode_action,
+    decode_compact_action,
+    legal_actions,
+)
+from codec import encode_game
+from piece import Piece
+from projectl import ActionEnum, ProjectLGame
+from puzzle import black_puzzles, white_puzzles
+
+
+def test_apply_undo() -> None:
+    for seed in range(4):
+        random.seed(seed)
+        game = ProjectLGame(2 + seed % 2)
+        while game.remaining_rounds != -1:
+            data = encode_game(game)
+            state = game.extract_state()
+            key, zobrist_key = game.hash(), game.zobrist_key
+            action_ids = legal_actions(game, master_limit=8)
+            for action_id in action_ids:
+                action = decode_compact_action(action_id)
+                record = game.apply(action)
+
+                played = ProjectLGame.from_bytes(data)
+                played.step_fast(action)
+                assert game.extract_state() == played.extract_state()
+                assert game.hash() == played.hash()
+                rehashed = game.zobrist_key
+                game.rehash()
+                assert game.zobrist_key == rehashed
+
+                game.undo(record)
+                assert encode_game(game) == data
+                assert game.extract_state() == state
+                assert (game.hash(), game.zobrist_key) == (key, zobrist_key)
+            game.step_fast(decode_compact_action(random.choice(action_ids)))
+
+
+def test_play_invalid_action_data() -> None:
+    game = ProjectLGame(2)
+    for action_data in [[1, 2], "puzzle", 3]:
+        with pytest.raises(ProjectLGame.InvalidAction):
+            game.play(
+                {"action": ActionEnum.TAKE_PUZZLE.value, "action_data": action_data}
+            )
+
+
+def test_setters_keep_zobrist() -> None:
+    random.seed(0)
+    game = ProjectLGame(2)
+    game.set_player_puzzles(1, [black_puzzles[0].copy(), white_puzzles[0].copy()])
+    game.set_table_puzzle(2, None)
+    game.set_table_puzzle(5, white_puzzles[1])
+    game.players_pieces[(1, Piece.RED)] = 2
+    zobrist_key = game.zobrist_key
+    game.rehash()
+    assert game.zobrist_key == zobrist_key
+
+
+def test_one_master_per_turn() -> None:
+    random.seed(0)
+    game = ProjectLGame(2)
+    while game.remaining_rounds != -1:
+        master_ids = [i for i in legal_actions(game, 1) if i >= MASTER_OFFSET]
+        if len(master_ids) > 0:
+            action = decode_compact_action(master_ids[0])
+            played = game.copy()
+            played.did_master_action = True
+            with pytest.raises(ProjectLGame.InvalidAction):
+                played.step_fast(action)
+            with pytest.raises(ProjectLGame.InvalidAction):
+                played.play(decode_action(master_ids[0]))
+            game.step_fast(action)
+            return
+        game.step_fast(decode_compact_action(random.choice(legal_actions(game))))
+    assert False, "no MASTER action found"
@@ -0,0 +1,14 @@
+import pytest
+
+from protocol import ActionMessage, parse_message
+
+
+def test_action_data_must_be_an_object() -> None:
+    message = parse_message('{"type": "action", "action": {"action": 4}}')
+    assert isinstance(message, ActionMessage)
+    assert message.action == {"action": 4, "action_data": {}}
+    for action_data in ["[1, 2]", '"puzzle"', "3"]:
+        with pytest.raises(ValueError):
+            parse_message(
+                f'{{"type": "action", "action": {{"action": 0, "action_data": {action_data}}}}}'
+            )
@@ -0,0 +1,101 @@
+import functools
+import random
+import typing
+
+from piece import BOARD_CELLS, PIECE_TYPES, Piece, piece_index, placements
+from puzzle import Puzzle
+
+# Random 64 bit keys for every part of a game. The hash of a game is the xor
+# of the keys of what it currently has, so every change can be applied (and
+# reverted) by xoring the keys of the old and the new values.
+#
+# A puzzle "owner" is a place where a puzzle can be: the 4 puzzle slots of
+# each player followed by the 8 table slots.
+
+MAX_PLAYERS = 4
+MAX_PLAYER_PUZZLES = 4
+TABLE_SLOTS = 8
+OWNERS = MAX_PLAYERS * MAX_PLAYER_PUZZLES + TABLE_SLOTS
+CELL_VALUES = 16
+COUNTER_KEYS = 64
+
+# fixed seed, so the same state has the same hash in every process
+key_generator = random.Random(0x5EED)
+
+
+def random_keys(quantity: int) -> typing.List[int]:
+    return [key_generator.getrandbits(64) for _ in range(quantity)]
+
+
+cell_keys = random_keys(OWNERS * BOARD_CELLS * CELL_VALUES)
+reward_keys = random_keys(OWNERS * PIECE_TYPES)
+points_keys = random_keys(OWNERS * CELL_VALUES)
+inventory_keys = random_keys(MAX_PLAYERS * PIECE_TYPES * COUNTER_KEYS)
+score_keys = random_keys(MAX_PLAYERS * COUNTER_KEYS)
+current_player_keys = random_keys(MAX_PLAYERS)
+remaining_actions_keys = random_keys(COUNTER_KEYS)
+remaining_rounds_keys = random_keys(COUNTER_KEYS)
+points_to_pay_keys = random_keys(COUNTER_KEYS)
+black_deck_keys = random_keys(COUNTER_KEYS)
+white_deck_keys = random_keys(COUNTER_KEYS)
+master_key = key_generator.getrandbits(64)
+no_rounds_key = key_generator.getrandbits(64)
+
+
+def player_owner(player: int, slot: int) -> int:
+    return player * MAX_PLAYER_PUZZLES + slot
+
+
+def table_owner(which_puzzle: int) -> int:
+    return MAX_PLAYERS * MAX_PLAYER_PUZZLES + which_puzzle
+
+
+def cell_key(owner: int, cell: int, value: int) -> int:
+    return cell_keys[(owner * BOARD_CELLS + cell) * CELL_VALUES + value]
+
+
+def puzzle_key(owner: int, puzzle: Puzzle) -> int:
+    return filled_puzzle_key(owner, puzzle.cells, puzzle.points, puzzle.reward)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def filled_puzzle_key(owner: int, cells: int, points: int, reward: Piece) -> int:
+    # the same puzzles show up over and over again in the same places
+    key = (
+        reward_keys[owner * PIECE_TYPES + piece_index[reward]]
+        ^ points_keys[owner * CELL_VALUES + points % CELL_VALUES]
+    )
+    for cell in range(BOARD_CELLS):
+        key ^= cell_key(owner, cell, cells >> (4 * cell) & 0xF)
+    return key
+
+
+def inventory_key(slot: int, quantity: int) -> int:
+    return inventory_keys[slot * COUNTER_KEYS + quantity % COUNTER_KEYS]
+
+
+def score_key(player: int, points: int) -> int:
+    return score_keys[player * COUNTER_KEYS + points % COUNTER_KEYS]
+
+
+def build_placement_keys() -> typing.List[int]:
+    # what placing a piece changes in the hash of a player puzzle, indexed by
+    # player_owner(...) * len(placements) + placement.placement_id
+    keys: typing.List[int] = []
+    for owner in range(MAX_PLAYERS * MAX_PLAYER_PUZZLES):
+        for placement in placements:
+            key = 0
+            for cell in range(BOARD_CELLS):
+                if placement.mask >> cell & 1:
+                    key ^= cell_key(owner, cell, 0) ^ cell_key(
+                        owner, cell, placement.piece.value
+                    )
+            keys.append(key)
+    return keys
+
+
+placement_keys = build_placement_keys()
+
+
+def placement_key(owner: int, placement_index: int) -> int:
+    return placement_keys[owner * len(placements) + placement_index]